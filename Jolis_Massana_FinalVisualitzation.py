@@ -1,41 +1,577 @@
+import functools
+import hashlib
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from statistics import NormalDist
+
 import streamlit as st
+import numpy as np
 import pandas as pd
 import altair as alt
-from vega_datasets import data
 
 # for County choropleths 
 import geopandas as gpd
-from shapely.geometry import Point
-from shapely.geometry import Polygon, MultiPolygon
+import shapely
+from pyarrow import feather
+
+
+# map shapes and county FIPS list bundled in static/ (built by 'python ingest.py topology') and served by
+# Streamlit's static file serving, so the charts need no external network access
+TOPOLOGY_URL = 'app/static/us_topology.json'
+COUNTY_FIPS_PATH = os.path.join('static', 'county_fips.csv')
+
+# with compact lookups each chart only carries the columns its encodings use; Altair already hoists the
+# data into named top-level datasets, so layers looking up the same frame share a single copy
+COMPACT_LOOKUPS = True
+
+# the county choropleth values are aggregated here and shipped rounded to VALUE_PRECISION decimals; with
+# COLOR_BUCKETS set, the colors are also quantized here into that many quantile classes, so Vega only maps
+# a handful of ordinal values instead of interpolating a continuous scale per county
+VALUE_PRECISION = 2
+COLOR_BUCKETS = None
+
+# data for states not appearing in the original dataset: [FIPS, Population]
+MISSING_STATES = {
+    'Montana': [30, 1122878],
+    'Wyoming': [56, 584057],
+    'Vermont': [50, 643077],
+}
+
+# census regions, for the per-region fits of Q3
+CENSUS_REGIONS = {
+    'Northeast': ['Connecticut', 'Maine', 'Massachusetts', 'New Hampshire', 'New Jersey', 'New York', 'Pennsylvania',
+                  'Rhode Island', 'Vermont'],
+    'Midwest': ['Illinois', 'Indiana', 'Iowa', 'Kansas', 'Michigan', 'Minnesota', 'Missouri', 'Nebraska', 'North Dakota',
+                'Ohio', 'South Dakota', 'Wisconsin'],
+    'South': ['Alabama', 'Arkansas', 'Delaware', 'District of Columbia', 'Florida', 'Georgia', 'Kentucky', 'Louisiana',
+              'Maryland', 'Mississippi', 'North Carolina', 'Oklahoma', 'South Carolina', 'Tennessee', 'Texas', 'Virginia',
+              'West Virginia'],
+    'West': ['Alaska', 'Arizona', 'California', 'Colorado', 'Hawaii', 'Idaho', 'Montana', 'Nevada', 'New Mexico', 'Oregon',
+             'Utah', 'Washington', 'Wyoming'],
+}
+
+
+
+def lookup_data(df, key, fields):
+    """LookupData restricted to the looked-up fields (all columns when COMPACT_LOOKUPS is off)."""
+    if not COMPACT_LOOKUPS:
+        return alt.LookupData(df, key, list(df.columns))
+    return alt.LookupData(df[[key] + fields], key, fields)
+
+
+def color_classes(values, buckets, precision=VALUE_PRECISION):
+    """Lower edge of the quantile class of each value; zeros form a class of their own."""
+    classes = pd.Series(0.0, index=values.index)
+    positive = values > 0
+    if positive.any():
+        codes, edges = pd.qcut(values[positive], buckets, labels=False, retbins=True, duplicates='drop')
+        classes[positive] = edges.round(precision)[codes]
+    return classes
+
+
+
+############# PROFILING #############
+# per-stage wall time, peak memory (as traced by tracemalloc) and row counts, logged as JSON lines on the
+# 'dashboard.profile' logger and listed in a debug panel; off unless DASHBOARD_PROFILE=1 (every session) or the
+# session opened the page with ?profile=1. Records are kept per thread, so each script run and each chart worker
+# collects its own, and tracemalloc only runs while some thread is profiling; memory is traced for the whole
+# process though, so the peaks of stages running at the same time include each other's allocations
+
+PROFILING = os.environ.get('DASHBOARD_PROFILE') == '1'
+profile_logger = logging.getLogger('dashboard.profile')
+_profile = threading.local() # records and open stage peaks of the profiled run on this thread
+
+@st.cache_resource(show_spinner=False)
+def _profiling_threads():
+    # kept across reruns, which execute this script (and its module globals) anew
+    return set()
+
+
+def start_profiling():
+    """Profiles the stages run on this thread from now on, starting with no records."""
+    _profile.records = []
+    _profile.open_peaks = [] # peak memory reached so far by each enclosing stage
+    _profiling_threads().add(threading.get_ident())
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if not profile_logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        profile_logger.addHandler(handler)
+        profile_logger.setLevel(logging.INFO)
+
+
+def stop_profiling():
+    threads = _profiling_threads()
+    threads.discard(threading.get_ident())
+    _profile.__dict__.clear()
+    if not threads and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def profiling():
+    return hasattr(_profile, 'records')
+
+
+def profile_records():
+    return list(getattr(_profile, 'records', []))
+
+
+@contextmanager
+def stage(name, rows=None):
+    """Times the enclosed block; the yielded record takes the row count if it is only known at the end."""
+    record = {'stage': name, 'rows': rows}
+    if not profiling():
+        yield record
+        return
+    open_peaks = _profile.open_peaks
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if open_peaks:
+        open_peaks[-1] = max(open_peaks[-1], tracemalloc.get_traced_memory()[1])
+    tracemalloc.reset_peak()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    open_peaks.append(0)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        seconds = time.perf_counter() - start
+        peak = max(open_peaks.pop(), tracemalloc.get_traced_memory()[1])
+        if open_peaks:
+            open_peaks[-1] = max(open_peaks[-1], peak)
+        record.update(seconds=round(seconds, 4), peak_mb=round((peak - start_memory) / 2**20, 2), pid=os.getpid())
+        _profile.records.append(record)
+        profile_logger.info(json.dumps(record, default=str))
+
+
+def profiled(function):
+    """Runs the decorated function as a stage named after it, counting the rows of its first argument."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        rows = len(args[0]) if args and hasattr(args[0], '__len__') else None
+        with stage(function.__name__, rows):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+
+############# DIMENSIONS #############
+# states and counties are keyed by integer codes: the 'State' columns of the incident tables share one
+# Categorical (a small integer per row instead of a string), and counties are identified by their numeric
+# FIPS code, which is also the feature id of the map topology; county names are built once, in county_dimension
+
+def state_dtype(*tables):
+    """Categorical dtype over the state names of the given tables and the states without incidents, sorted."""
+    names = set(MISSING_STATES)
+    for df in tables:
+        names.update(df['State'].dropna().unique())
+    return pd.CategoricalDtype(sorted(names))
+
+
+def with_state_codes(dtype, *tables):
+    """The tables with their 'State' column recoded to the shared categories."""
+    return [df.assign(State = df['State'].astype(dtype)) for df in tables]
+
+
+def county_dimension(county_population):
+    """'County, ST' name and 2023 population by county FIPS, from CountyPopulation.csv."""
+    return pd.DataFrame({
+        # to take into account same County names in different States
+        'County': county_population['Area_Name'].astype(str) + ', ' + county_population['State'].astype(str),
+        # the CSV stores populations as '5,024,279' strings
+        'County Population': pd.to_numeric(county_population['POP_ESTIMATE_2023'].astype(str).str.replace(',', ''), errors='coerce'),
+    }).set_index(county_population['FIPStxt'].rename('County FIPS'))
+
+
+
+############# STATE AGGREGATION #############
+@profiled
+def aggregate_states(mass_shootings):
+    """Per-state tallies and per-capita ratios shared by the bar chart and the state choropleths."""
+    return state_ratios(state_tallies(mass_shootings))
+
+
+def state_tallies(mass_shootings, by='State'):
+    """Incident and suspect counts per state (or per state and month, ...), with the state FIPS and population."""
+    incidents = mass_shootings[['State', 'FIPS', 'Population', 'Suspects Injured', 'Suspects Killed']].assign(
+        Suspects = mass_shootings['Suspects Injured'] + mass_shootings['Suspects Killed'] + mass_shootings['Suspects Arrested'].astype(int))
+
+    # one groupby pass: FIPS and Population are constant per state, the suspect counts are summed
+    return incidents.groupby(by, observed=True).agg(**{
+        'FIPS': ('FIPS', 'last'),
+        'Total Shootings': ('FIPS', 'size'),
+        'Population': ('Population', 'last'),
+        'Suspects Injured': ('Suspects Injured', 'sum'),
+        'Suspects Killed': ('Suspects Killed', 'sum'),
+        'Suspects': ('Suspects', 'sum'),
+    }).astype('int64')
+
+
+def state_ratios(tallies):
+    """State tallies completed with the states without incidents and the per-capita ratios."""
+    missing = pd.DataFrame.from_dict(MISSING_STATES, orient='index', columns=['FIPS', 'Population'])
+    missing = missing[~missing.index.isin(tallies.index)]
+    state_shootings = pd.concat([tallies, missing]).fillna(0).astype('int64')
+    # the charts get plain state names
+    state_shootings.index = state_shootings.index.astype(str)
+    state_shootings = state_shootings.rename_axis('State').reset_index()
+
+    state_shootings['Shootings per 1M Habitants'] = state_shootings['Total Shootings'] / state_shootings['Population'] * 10**6 # 10**6 is a scaling factor
+    state_shootings['% of Suspects Injured'] = state_shootings['Suspects Injured'] / state_shootings['Suspects'] * 100
+    state_shootings['% of Suspects Killed'] = state_shootings['Suspects Killed'] / state_shootings['Suspects'] * 100
+
+    # there's three states where Total Shootings = 0, for them, we have computed 0 / 0 when creating the last two columns
+    state_shootings.fillna(0, inplace=True)
+
+    return state_shootings
+
+
+
+############# COUNTY ASSIGNMENT #############
+# incident -> county GEOID, looked up once and stored next to the incidents;
+# later runs only locate the Incident IDs that are not in the stored file yet
+
+COUNTY_ASSIGNMENT_PATH = 'MassShootings_Counties.csv'
+
+def prepare_counties(counties_gdf):
+    """County polygons in the coordinate order of the incident data, without Puerto Rico."""
+    counties_gdf = counties_gdf[['STATEFP', 'GEOID', 'NAME', 'geometry']] # reducing dimensionality
+
+    # swapping coordinates, for the whole geometry array at once (multi-part counties and holes included)
+    with stage('coordinate swap', len(counties_gdf)):
+        counties_gdf = counties_gdf.set_geometry(counties_gdf.geometry.transform(lambda coordinates: coordinates[:, ::-1]))
+
+    # ensuring the use of the same coordinate system as the incidents
+    with stage('reprojection', len(counties_gdf)):
+        counties_gdf = counties_gdf.to_crs(epsg=4326)
+
+    # dropping Puerto Rico, because it is outside of the North America region
+    return counties_gdf[counties_gdf['STATEFP'] != '72']
+
+
+# cells of the coarse lookup grid, in degrees; it is built on the first batch of at least
+# COARSE_GRID_MIN_POINTS points, below that its construction costs more than it saves
+COARSE_CELL = 0.02
+COARSE_GRID_MIN_POINTS = 100_000
+
+class CountyLocator:
+    """Point-in-county lookup at two levels of detail, built once and queried many times.
+
+    The coarse level is a grid over the contiguous US whose cells lying entirely inside a county map straight to it,
+    so most points of a large batch are placed by array indexing alone; only the borderline points (near a county
+    border or outside the grid) are looked up in an STRtree of the exact county polygons; cell_size=None keeps
+    every lookup on the exact level. Coordinates are given as stored in the incident data, i.e. the 'Longitude' and 'Latitude' columns of MassShootings.csv.
+    """
+
+    def __init__(self, counties_gdf, cell_size=COARSE_CELL):
+        counties_gdf = prepare_counties(counties_gdf)
+        self.geoids = counties_gdf['GEOID'].astype('int32').to_numpy()
+        self.polygons = counties_gdf.geometry.to_numpy()
+        shapely.prepare(self.polygons)
+        self.tree = shapely.STRtree(self.polygons)
+        self.cell_size = cell_size
+        # Alaska and Hawaii are left out of the grid, which would otherwise span most of the globe
+        self.in_grid = ~counties_gdf['STATEFP'].isin(['02', '15']).to_numpy()
+        self.grid = None
+
+    def build_grid(self):
+        """Index of the county containing each whole cell of the coarse grid (-1 for cells crossed by a border)."""
+        with stage('coarse grid', len(self.polygons)):
+            self.origin = shapely.total_bounds(self.polygons[self.in_grid])
+            x0, y0, x1, y1 = self.origin
+            shape = int(np.ceil((x1 - x0) / self.cell_size)), int(np.ceil((y1 - y0) / self.cell_size))
+            self.grid = np.full(shape, -1, dtype='int16')
+
+            # a cell is inside a county when its center is inside the county shrunk by a bit more than
+            # half the cell diagonal (the margin covers the polygonal approximation of the buffer)
+            shrunk = shapely.buffer(self.polygons, -0.75 * self.cell_size)
+            bounds = shapely.bounds(shrunk)
+            for county in np.flatnonzero(self.in_grid & ~shapely.is_empty(shrunk)):
+                minx, miny, maxx, maxy = bounds[county]
+                columns = np.arange(max(int((minx - x0) / self.cell_size), 0), min(int((maxx - x0) / self.cell_size) + 1, shape[0]))
+                rows = np.arange(max(int((miny - y0) / self.cell_size), 0), min(int((maxy - y0) / self.cell_size) + 1, shape[1]))
+                columns, rows = (index.ravel() for index in np.meshgrid(columns, rows, indexing='ij'))
+                inside = shapely.contains_xy(shrunk[county], x0 + (columns + 0.5) * self.cell_size, y0 + (rows + 0.5) * self.cell_size)
+                self.grid[columns[inside], rows[inside]] = county
+
+    def grid_lookup(self, longitudes, latitudes):
+        """Index of the county of every point whose grid cell lies inside one (-1 for the borderline points)."""
+        if self.grid is None:
+            self.build_grid()
+        x0, y0, x1, y1 = self.origin
+        county_index = np.full(len(longitudes), -1, dtype=np.intp)
+        # comparisons on the coordinates themselves, so missing ones stay borderline
+        on_grid = np.flatnonzero((longitudes >= x0) & (longitudes < x1) & (latitudes >= y0) & (latitudes < y1))
+        columns = ((longitudes[on_grid] - x0) // self.cell_size).astype(np.intp)
+        rows = ((latitudes[on_grid] - y0) // self.cell_size).astype(np.intp)
+        county_index[on_grid] = self.grid[columns, rows]
+        return county_index
+
+    def locate(self, longitudes, latitudes):
+        """County FIPS code of every point of a batch (<NA> outside every county)."""
+        longitudes = np.asarray(longitudes, dtype=float)
+        latitudes = np.asarray(latitudes, dtype=float)
+        with stage('county lookup', len(longitudes)):
+            if self.cell_size and (len(longitudes) >= COARSE_GRID_MIN_POINTS or self.grid is not None):
+                county_index = self.grid_lookup(longitudes, latitudes)
+            else:
+                county_index = np.full(len(longitudes), -1, dtype=np.intp)
+            borderline = np.flatnonzero(county_index < 0)
+            point_index, exact_index = self.tree.query(shapely.points(longitudes[borderline], latitudes[borderline]), predicate='within')
+            county_index[borderline[point_index]] = exact_index
+
+        missing = county_index < 0
+        return pd.arrays.IntegerArray(np.where(missing, 0, self.geoids[county_index]).astype('int32'), missing)
+
+    def locate_point(self, longitude, latitude):
+        """County FIPS code of a single point (None outside every county)."""
+        county_index = self.tree.query(shapely.Point(longitude, latitude), predicate='within')
+        return int(self.geoids[county_index[0]]) if len(county_index) > 0 else None
+
+
+def assign_counties(mass_shootings, counties_gdf, county_locator=None):
+    """County FIPS code of each incident (<NA> when its coordinates fall outside every county)."""
+    if county_locator is None:
+        county_locator = CountyLocator(counties_gdf)
+    return pd.DataFrame({
+        'Incident ID': mass_shootings['Incident ID'].to_numpy(),
+        'GEOID': county_locator.locate(mass_shootings['Longitude'], mass_shootings['Latitude']),
+    })
+
+
+@profiled
+def update_county_assignment(mass_shootings, counties_gdf, path=COUNTY_ASSIGNMENT_PATH):
+    """Stored incident -> county assignment, extended with a spatial join over the new Incident IDs only."""
+    if os.path.exists(path):
+        county_assignment = pd.read_csv(path, dtype={'GEOID': 'Int32'})
+    else:
+        county_assignment = pd.DataFrame({'Incident ID': pd.Series(dtype='int64'), 'GEOID': pd.Series(dtype='Int32')})
+
+    new_incidents = mass_shootings[~mass_shootings['Incident ID'].isin(county_assignment['Incident ID'])]
+    if len(new_incidents) > 0:
+        county_assignment = pd.concat([county_assignment, assign_counties(new_incidents, counties_gdf)], ignore_index=True)
+        replace_file(path, lambda temporary: county_assignment.to_csv(temporary, index=False))
+
+    return county_assignment
+
+
+
+############# MONTHLY COUNTS #############
+# (state x month) incident-count cube: one row per state, one column per month with incidents;
+# the line chart and any date-window count per state are slices of it, so the incident dates
+# are parsed once instead of in every question
+
+@profiled
+def monthly_counts(mass_shootings):
+    """Incident counts per state and month."""
+    return mass_shootings.groupby([mass_shootings['State'], incident_months(mass_shootings)], observed=True).size().unstack(fill_value=0)
+
+
+def incident_months(df):
+    return pd.to_datetime(df['Incident Date']).dt.tz_localize(None).dt.to_period('M').rename('Year_Month')
+
+
+def counts_since(cube, month, until=None):
+    """Incidents per state from the given month ('YYYY-MM') onwards (up to 'until', inclusive), for states with at least one."""
+    in_window = cube.columns >= pd.Period(month, 'M')
+    if until is not None:
+        in_window &= cube.columns <= pd.Period(until, 'M')
+    counts = cube.loc[:, in_window].sum(axis=1)
+    return counts[counts > 0]
+
+
+
+############# AGGREGATE STATE #############
+# the feeds only grow by appending incidents with new, higher Incident IDs, so the tallies behind every chart
+# are stored with the highest IDs they include and a refresh only aggregates the incidents above them;
+# 'python ingest.py aggregates --verify' checks the stored tallies against a full recompute
+
+AGGREGATES_PATH = 'aggregates.pkl'
+STATE_COUNTS = ['Total Shootings', 'Suspects Injured', 'Suspects Killed', 'Suspects']
+
+def county_tallies(mass_shootings, county_assignment):
+    """Incident count per county FIPS."""
+    geoids = county_assignment.loc[county_assignment['Incident ID'].isin(mass_shootings['Incident ID']), 'GEOID']
+    return geoids.dropna().astype('int64').value_counts().sort_index()
+
+
+def school_tallies(school_incidents):
+    """School incident count per state."""
+    return school_incidents.groupby('State', observed=True).size()
+
+
+def with_state_names(tallies):
+    """Tallies keyed by plain state names, whatever categories the incidents were grouped by."""
+    if isinstance(tallies.index, pd.MultiIndex):
+        return tallies.set_axis(tallies.index.set_levels(tallies.index.levels[0].astype(str), level=0))
+    return tallies.set_axis(tallies.index.astype(str))
+
+
+def last_incident_id(df):
+    return int(df['Incident ID'].max()) if len(df) > 0 else 0
+
+
+def compute_aggregates(mass_shootings, school_incidents, county_assignment):
+    """All tallies, computed from scratch.
+
+    The '_months' tallies break the others down by month, so that any month range and set of states
+    is a slice of them (see query_aggregates).
+    """
+    months = incident_months(mass_shootings)
+    school_months = incident_months(school_incidents)
+    state_months = state_tallies(mass_shootings, by=['State', months])[STATE_COUNTS]
+    assigned = county_assignment.dropna(subset=['GEOID']).merge(pd.DataFrame({'Incident ID': mass_shootings['Incident ID'], 'Year_Month': months}))
+    # stored keyed by state names, so tallies grouped over different category sets add up
+    return {
+        'last_incident_id': last_incident_id(mass_shootings),
+        'last_school_incident_id': last_incident_id(school_incidents),
+        'states': with_state_names(state_tallies(mass_shootings)),
+        'counties': county_tallies(mass_shootings, county_assignment),
+        'months': with_state_names(state_months['Total Shootings'].unstack(fill_value=0)),
+        'schools': with_state_names(school_tallies(school_incidents)),
+        'state_months': with_state_names(state_months),
+        'county_months': assigned.groupby([assigned['GEOID'].astype('int64'), 'Year_Month']).size(),
+        'school_months': with_state_names(school_months.groupby([school_incidents['State'], school_months], observed=True).size()),
+    }
+
+
+@profiled
+def update_aggregates(aggregates, mass_shootings, school_incidents, county_assignment):
+    """Tallies extended with the incidents added since they were computed (all of them when aggregates is None)."""
+    if aggregates is None:
+        return compute_aggregates(mass_shootings, school_incidents, county_assignment)
+
+    new_incidents = mass_shootings[mass_shootings['Incident ID'] > aggregates['last_incident_id']]
+    new_school_incidents = school_incidents[school_incidents['Incident ID'] > aggregates['last_school_incident_id']]
+    if len(new_incidents) == 0 and len(new_school_incidents) == 0:
+        return aggregates
+    delta = compute_aggregates(new_incidents, new_school_incidents, county_assignment)
+
+    # FIPS and population are constant per state, only the counts add up
+    states = aggregates['states'].reindex(aggregates['states'].index.union(delta['states'].index))
+    states[STATE_COUNTS] = states[STATE_COUNTS].fillna(0) + delta['states'][STATE_COUNTS].reindex(states.index, fill_value=0)
+    states[['FIPS', 'Population']] = states[['FIPS', 'Population']].fillna(delta['states'][['FIPS', 'Population']])
+
+    return {
+        'last_incident_id': max(aggregates['last_incident_id'], delta['last_incident_id']),
+        'last_school_incident_id': max(aggregates['last_school_incident_id'], delta['last_school_incident_id']),
+        'states': states.astype('int64'),
+        'counties': aggregates['counties'].add(delta['counties'], fill_value=0).astype('int64'),
+        'months': aggregates['months'].add(delta['months'], fill_value=0).fillna(0).astype('int64').sort_index(axis=1),
+        'schools': aggregates['schools'].add(delta['schools'], fill_value=0).astype('int64'),
+        'state_months': aggregates['state_months'].add(delta['state_months'], fill_value=0).astype('int64'),
+        'county_months': aggregates['county_months'].add(delta['county_months'], fill_value=0).astype('int64'),
+        'school_months': aggregates['school_months'].add(delta['school_months'], fill_value=0).astype('int64'),
+    }
+
+
+def verify_aggregates(aggregates, mass_shootings, school_incidents, county_assignment):
+    """Names of the stored tallies that differ from a full recompute."""
+    expected = compute_aggregates(mass_shootings, school_incidents, county_assignment)
+    mismatches = []
+    for name, value in expected.items():
+        stored = aggregates[name]
+        if isinstance(value, (pd.Series, pd.DataFrame)):
+            stored = stored.sort_index()
+            value = value.sort_index()
+            if isinstance(value, pd.DataFrame):
+                stored = stored.sort_index(axis=1)
+                value = value.sort_index(axis=1)
+            same = stored.astype('int64').equals(value.astype('int64'))
+        else:
+            same = stored == value
+        if not same:
+            mismatches.append(name)
+    return mismatches
+
+
+AGGREGATE_NAMES = ['last_incident_id', 'last_school_incident_id', 'states', 'counties', 'months', 'schools',
+                   'state_months', 'county_months', 'school_months']
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _read_aggregates(path, version):
+    # shared, not copied: the tallies are never modified in place (update_aggregates builds new ones)
+    aggregates = pd.read_pickle(path)
+    return aggregates if all(name in aggregates for name in AGGREGATE_NAMES) else None
+
+
+def load_aggregates(path=AGGREGATES_PATH):
+    """Stored tallies, or None when there are none (or they were stored by an older version without all of them)."""
+    if not os.path.exists(path):
+        return None
+    return _read_aggregates(str(path), file_version(path))
+
+
+def query_aggregates(aggregates, first_month=None, last_month=None, states=None):
+    """Chart inputs for the incidents between two months ('YYYY-MM', inclusive) in the given states (all when empty).
+
+    The state x month cube keeps every month, as Q3 and Q4 take the month range themselves.
+    """
+    if first_month is None and last_month is None and not states:
+        return {'states': state_ratios(aggregates['states']), 'counties': aggregates['counties'],
+                'months': aggregates['months'], 'schools': aggregates['schools']}
+
+    def in_window(tallies, allowed, key=lambda values: values):
+        """Tallies summed over the selected months, restricted to the first index level values whose key is allowed."""
+        months = tallies.index.get_level_values('Year_Month')
+        selected = np.ones(len(tallies), dtype=bool)
+        if first_month is not None:
+            selected &= months >= pd.Period(first_month, 'M')
+        if last_month is not None:
+            selected &= months <= pd.Period(last_month, 'M')
+        if states:
+            selected &= key(tallies.index.get_level_values(0)).isin(allowed)
+        return tallies[selected].groupby(level=0).sum()
+
+    counts = in_window(aggregates['state_months'], states)
+    tallies = aggregates['states'][['FIPS', 'Population']].join(counts).fillna(0).astype('int64')[aggregates['states'].columns]
+    state_shootings = state_ratios(tallies)
+    state_fips = aggregates['states'].loc[aggregates['states'].index.isin(states or ()), 'FIPS']
+    cube = aggregates['months']
+    if states:
+        state_shootings = state_shootings[state_shootings['State'].isin(states)].reset_index(drop=True)
+        cube = cube[cube.index.isin(states)]
+    return {
+        'states': state_shootings,
+        # county FIPS codes start with the state FIPS
+        'counties': in_window(aggregates['county_months'], state_fips, key=lambda geoids: geoids // 1000),
+        'months': cube,
+        'schools': in_window(aggregates['school_months'], states),
+    }
+
+
+def refresh_aggregates(mass_shootings, school_incidents, county_assignment, path=AGGREGATES_PATH):
+    """Stored tallies brought up to date with the datasets, and stored again if anything was added."""
+    aggregates = load_aggregates(path)
+    updated = update_aggregates(aggregates, mass_shootings, school_incidents, county_assignment)
+    if updated is not aggregates:
+        replace_file(path, lambda temporary: pd.to_pickle(updated, temporary))
+    return updated
 
 
 
 ############# QUESTION 1 #############
-def first_question(mass_shootings):   
+@profiled
+def first_question(mass_shootings, state_shootings=None):   
     """Bar chart displaying the quantity of mass shootings by state, with emphasis on the top 10 states."""# Q1: What are the states with large number of mass shootings per citizen?
     
         #--------------- DATA PREPARATION ---------------#
 
-    state_shootings = {state: [0, 0] for state in set(mass_shootings['State'])}
-                            # ['Shootings', 'Population']
-    
-    # data for states not appearing in the original dataset
-    state_shootings['Montana'] = [0, 1122878]
-    state_shootings['Wyoming'] = [0, 584057]
-    state_shootings['Vermont'] = [0, 643077]
-
-    for _, row in mass_shootings.iterrows():
-        current_state = row['State']
-        current_population = row['Population']
-
-        state_shootings[current_state][0] += 1 # occurrence count
-        state_shootings[current_state][1] = current_population
-
-    state_shootings = pd.DataFrame.from_dict(state_shootings, orient='index',
-                                             columns=['Total Shootings', 'Population'])
-    state_shootings = state_shootings.reset_index().rename(columns={'index': 'State'})
-    state_shootings.groupby(['State']).sum()
-    state_shootings['Shootings per 1M Habitants'] = state_shootings['Total Shootings'] / state_shootings['Population'] * 10**6
+    if state_shootings is None:
+        state_shootings = aggregate_states(mass_shootings)
+    state_shootings = state_shootings[['State', 'Shootings per 1M Habitants']]
 
     # sort state values in descending order
     state_shootings = state_shootings.sort_values(by = 'Shootings per 1M Habitants', ascending = False).reset_index(drop = True)
@@ -86,46 +622,25 @@ def first_question(mass_shootings):
 
 
 ############# QUESTION 2 #############
-def second_question(mass_shootings, county_population, counties_gdf):   
+def second_question(mass_shootings, county_population, counties_gdf, state_shootings=None, county_assignment=None):   
     # Q2: How is the number of mass shootings per citizen distributed accross the different counties in the US?
     #     And accross states?
-    
-    ############# SHOOTINGS PER STATES #############
+    if state_shootings is None:
+        state_shootings = aggregate_states(mass_shootings)
 
-    #--------------- DATA PREPARATION ---------------#
+    Q2_state_map_final, Qextra_injured_map_final, Qextra_killed_map_final = second_question_states(state_shootings)
+    Q2_county_map_final = second_question_counties(mass_shootings, county_population, counties_gdf, county_assignment)
 
-    state_shootings = {state: [0, 0, 0, 0, 0, 0] for state in set(mass_shootings['State'])}
-                            # ['FIPS', 'Shootings', 'Population', 'Suspects Injured', 'Suspects Killed', 'Total Suspects']
+    return Q2_state_map_final, Q2_county_map_final, Qextra_injured_map_final, Qextra_killed_map_final
 
-    # data for states not appearing in the original dataset
-    state_shootings['Montana'] = [30, 0, 1122878, 0, 0, 0]
-    state_shootings['Wyoming'] = [56, 0, 584057, 0, 0, 0]
-    state_shootings['Vermont'] = [50, 0, 643077, 0, 0, 0]
-    
-    for _, row in mass_shootings.iterrows():
-        current_state = row['State']
-        current_FIPS = row['FIPS']
-        current_population = row['Population']
-        suspects_injured = row['Suspects Injured']
-        suspects_killed = row['Suspects Killed']
-        suspects_arrested = int(row['Suspects Arrested'])
-
-        state_shootings[current_state][0] = current_FIPS
-        state_shootings[current_state][1] += 1 # occurrence count
-        state_shootings[current_state][2] = current_population
-        state_shootings[current_state][3] += suspects_injured
-        state_shootings[current_state][4] += suspects_killed
-        state_shootings[current_state][5] += suspects_injured + suspects_killed + suspects_arrested 
-
-    state_shootings = pd.DataFrame.from_dict(state_shootings, orient='index',
-                                             columns=['FIPS', 'Total Shootings', 'Population', 'Suspects Injured', 'Suspects Killed', 'Suspects'])
-    state_shootings = state_shootings.reset_index().rename(columns={'index': 'State'})
-    state_shootings['Shootings per 1M Habitants'] = state_shootings['Total Shootings'] / state_shootings['Population'] * 10**6 # 10**6 is a scaling factor
-    state_shootings['% of Suspects Injured'] = state_shootings['Suspects Injured'] / state_shootings['Suspects'] * 100
-    state_shootings['% of Suspects Killed'] = state_shootings['Suspects Killed'] / state_shootings['Suspects'] * 100
-    
-    # there's three states where Total Shootings = 0, for them, we have computed 0 / 0 when creating the last two columns
-    state_shootings.fillna(0, inplace=True)
+
+@profiled
+def second_question_states(state_shootings):
+    """State choropleths of Q2: shootings per 1M habitants, and % of suspects injured / killed."""
+
+    ############# SHOOTINGS PER STATES #############
+
+    #--------------- DATA PREPARATION ---------------#
 
     # eliminating Columbia to expand color range, we will represent Columbia alternatively
     shootings_notcolumbia = state_shootings[state_shootings['FIPS'] != 11] 
@@ -134,12 +649,12 @@ def second_question(mass_shootings, county_population, counties_gdf):
 
     #--------------- CHOROPLETH PLOTTING ---------------#
 
-    USA_states = alt.topo_feature(data.us_10m.url, 'states')
+    USA_states = alt.topo_feature(TOPOLOGY_URL, 'states')
 
     state_shootings_map = alt.Chart(USA_states
     ).transform_lookup(
         lookup = 'id',
-        from_ = alt.LookupData(shootings_notcolumbia, 'FIPS', list(shootings_notcolumbia.columns))
+        from_ = lookup_data(shootings_notcolumbia, 'FIPS', ['State', 'Shootings per 1M Habitants'])
     ).mark_geoshape(stroke='darkgray'
     ).encode(
         color=alt.Color(
@@ -164,11 +679,14 @@ def second_question(mass_shootings, county_population, counties_gdf):
 
 
     # to highlight the District of Columbia in the map
+    # by name, one incident is filed under 'District of Columbia federal voting rights' with the same FIPS;
+    # no row when the state filter leaves Columbia out
+    columbia = state_shootings[state_shootings['State'] == 'District of Columbia']
     columbia_data = pd.DataFrame({
-        'Latitude': [38.89511],
-        'Longitude': [-77.03637],
-        'State': ['District of Columbia'],
-        'Shootings per 1M Habitants': [state_shootings[state_shootings['FIPS'] == 11]['Shootings per 1M Habitants'].iloc[0]]
+        'Latitude': 38.89511,
+        'Longitude': -77.03637,
+        'State': columbia['State'],
+        'Shootings per 1M Habitants': columbia['Shootings per 1M Habitants'],
     })
 
     columbia_zoom = alt.Chart(columbia_data).mark_circle(
@@ -191,96 +709,135 @@ def second_question(mass_shootings, county_population, counties_gdf):
     )
 
 
-    ############# SHOOTINGS PER COUNTIES #############
+    ############# SUSPECTS KILLED/INJURED PER STATES #############
 
-    #--------------- DATA PREPARATION ---------------#
+    #--------------- CHOROPLETH PLOTTING ---------------#
+
+    Qextra_injured_map_final = alt.Chart(USA_states
+    ).transform_lookup(
+        lookup = 'id',
+        from_ = lookup_data(state_shootings, 'FIPS', ['State', '% of Suspects Injured'])
+    ).mark_geoshape(stroke='darkgray'
+    ).encode(
+        color=alt.Color(
+        '% of Suspects Injured:Q',
+        legend=alt.Legend(
+            title= '% of Suspects Injured',
+            titleColor='black',
+            labelColor='black',
+            orient='top'
+        ),
+        scale=alt.Scale(scheme='lighttealblue')
+    ),
+        tooltip = ['State:N', '% of Suspects Injured:Q']
+    ).properties(
+        title = alt.TitleParams(
+            text = 'Percentage of Suspects Injured per shooting, by state',
+            fontSize = 18,
+            fontWeight='bold',
+            color = 'black'),
+        autosize='fit',
+        width='container',
+        height = 450
+    ).project(
+        type = 'albersUsa'
+    )
 
-    # to perform spatial join and intersect shooting coordinates with actual counties
-    geometry = [Point(lon_lat) for lon_lat in zip(mass_shootings['Longitude'], mass_shootings['Latitude'])]
-    mass_shootings_gdf = gpd.GeoDataFrame(mass_shootings[['State', 'FIPS']], geometry=geometry)
 
-    counties_gdf = counties_gdf[['STATEFP', 'GEOID', 'NAME', 'geometry']] # reducing dimensionality
+    Qextra_killed_map_final = alt.Chart(USA_states
+    ).transform_lookup(
+        lookup = 'id',
+        from_ = lookup_data(state_shootings, 'FIPS', ['State', '% of Suspects Killed'])
+    ).mark_geoshape(stroke='darkgray'
+    ).encode(
+        color=alt.Color(
+        '% of Suspects Killed:Q',
+        legend=alt.Legend(
+            title= '% of Suspects Killed',
+            titleColor='black',
+            labelColor='black',
+            orient='top'
+        ),
+        scale=alt.Scale(scheme='lighttealblue')
+    ),
+        tooltip = ['State:N', '% of Suspects Killed:Q']
+    ).properties(
+        title = alt.TitleParams(
+            text = 'Percentage of suspects killed per shooting, by state',
+            fontSize = 18,
+            fontWeight='bold',
+            color = 'black'),
+        autosize='fit',
+        width='container',
+        height = 450
+    ).project(
+        type = 'albersUsa'
+    )
 
-    # swapping coordinates
-    def swap_coordinates(geometry):
-        if isinstance(geometry, Polygon): 
-            return Polygon([(lon, lat) for lat, lon in geometry.exterior.coords])
-        elif isinstance(geometry, MultiPolygon): 
-            return  MultiPolygon([Polygon([(lat, lon) for (lat, lon) in polygon.exterior.coords]) for polygon in geometry.geoms])
+    return Q2_state_map_final, Qextra_injured_map_final, Qextra_killed_map_final
 
-    counties_gdf['geometry'] = counties_gdf['geometry'].apply(swap_coordinates) # swapping each row of the geometry column
 
-    # setting and ensuring the use of the same coordinate system 
-    mass_shootings_gdf.set_crs(epsg=4326, inplace=True)
-    counties_gdf = counties_gdf.to_crs(mass_shootings_gdf.crs)
+@profiled
+def second_question_counties(mass_shootings, county_population, counties_gdf, county_assignment=None, county_counts=None):
+    """County choropleth of Q2: shootings per 100K habitants, with the state borders on top.
 
-    # dropping Puerto Rico, because it is outside of the North America region
-    counties_gdf = counties_gdf[counties_gdf['STATEFP'] != '72'] 
-
-    coordinates_w_counties = mass_shootings_gdf.sjoin(counties_gdf, how='right', predicate='within')
-    # 'how=right' to ensure we keep all counties and their FIPS, even if there's no coordinate data for them in the mass_shootings dataframe
-    coordinates_w_counties = coordinates_w_counties[['GEOID', 'FIPS']]
-    coordinates_w_counties = coordinates_w_counties.set_axis(['FIPS', 'STATEFIPS'], axis=1)
-    coordinates_w_counties['FIPS'] = coordinates_w_counties['FIPS'].astype(int)
-
-    county_population = county_population[['FIPStxt', 'Area_Name', 'State', 'POP_ESTIMATE_2023']]
-    # to take into account same County names in different States
-    county_population['County'] = county_population['Area_Name'] + ', ' + county_population['State']
-    county_population = county_population[['FIPStxt', 'County', 'POP_ESTIMATE_2023']]
-    county_population = county_population.set_axis(['FIPS', 'COUNTYNAME', 'COUNTYPOPULATION'], axis=1)
-    
-    coordinates_w_counties = coordinates_w_counties.merge(county_population, on='FIPS')
-
-    county_shootings = {county: [0, 0, 0] for county in set(coordinates_w_counties['COUNTYNAME'])}
-                              # ['County FIPS', 'Shootings', 'County Population']
-    for _, row in coordinates_w_counties.iterrows():
-        current_county = row['COUNTYNAME']
-        current_county_FIPS = row['FIPS']
-        current_county_population = row['COUNTYPOPULATION']
-        if current_county_population is None:
-            current_county_population = 0
-        elif current_county_population is not None and type(current_county_population) == str: 
-            current_county_population = int(row['COUNTYPOPULATION'].replace(',', ''))
-        
-        county_shootings[current_county][0] = current_county_FIPS 
-        
-        # we only want to sum occurrences if we have shooting data for it
-        if pd.notna(row['STATEFIPS']):
-            county_shootings[current_county][1] += 1 # occurrence count
-        # if there's no data for this county in the original dataset, we keep the 'count' at 0
+    county_population is CountyPopulation.csv or the county_dimension built from it.
+    """
+
+    ############# SHOOTINGS PER COUNTIES #############
+
+    #--------------- DATA PREPARATION ---------------#
+
+    # occurrence count per county FIPS
+    if county_counts is None:
+        if county_assignment is None:
+            county_assignment = assign_counties(mass_shootings, counties_gdf)
+        county_counts = county_tallies(mass_shootings, county_assignment)
 
-        county_shootings[current_county][2] = current_county_population
+    # dropping Puerto Rico, because it is outside of the North America region
+    counties = counties_gdf.loc[counties_gdf['STATEFP'] != '72', 'GEOID'].astype(int)
 
-    county_shootings = pd.DataFrame.from_dict(county_shootings, orient='index',
-                                              columns=['County FIPS', 'Total Shootings', 'County Population'])
+    if 'FIPStxt' in county_population.columns:
+        county_population = county_dimension(county_population)
+    county_shootings = county_population[county_population.index.isin(counties)].reset_index()
 
+    # if there's no data for this county in the original dataset, we keep the 'count' at 0
+    county_shootings = county_shootings.assign(**{'Total Shootings': county_shootings['County FIPS'].map(county_counts).fillna(0).astype(int)})
     county_shootings['Shootings per 100K habitants'] = county_shootings['Total Shootings'] * 1 / county_shootings['County Population'] * 10**5 # 10**5 is a scaling factor
-    county_shootings.fillna(0, inplace=True)
+    county_shootings = county_shootings.fillna({'County Population': 0, 'Shootings per 100K habitants': 0})
 
-    full_FIPS_list = data.unemployment() # contains all FIPS inside the USA area in the column 'id', plottable in Altair
-    # adding the remaining rows of 'unemployment_df['id']' to have all plotable county FIPS
-    for f in full_FIPS_list['id']:
-        if f not in set(county_shootings['County FIPS']):  
-            num_of_rows = county_shootings.shape[0] 
-            county_shootings.loc[num_of_rows] = [f, 0, 0, 0]
+    full_FIPS_list = load_csv(COUNTY_FIPS_PATH) # contains all FIPS inside the USA area in the column 'id', plottable in Altair
+    # a single reindex on 'full_FIPS_list['id']' keeps only plotable county FIPS and adds the missing ones with zeros
+    county_shootings = county_shootings.set_index('County FIPS').reindex(full_FIPS_list['id'])
+    county_shootings = county_shootings.fillna({'Total Shootings': 0, 'County Population': 0, 'Shootings per 100K habitants': 0})
+    county_shootings['Total Shootings'] = county_shootings['Total Shootings'].astype(int)
 
-    # only keeping County FIPS
-    county_shootings = county_shootings[county_shootings['County FIPS'].isin(set(full_FIPS_list['id']))]
-    
-    county_shootings = county_shootings.reset_index().rename(columns={'index': 'County'})
+    county_shootings = county_shootings.rename_axis('County FIPS').reset_index()
+    county_shootings = county_shootings[['County', 'County FIPS', 'Total Shootings', 'County Population', 'Shootings per 100K habitants']]
+
+    # only the values the encodings need reach the browser, rounded, and optionally already classified
+    rate = 'Shootings per 100K habitants'
+    county_fields = ['County', rate]
+    color_field = f'{rate}:Q'
+    if COLOR_BUCKETS:
+        county_shootings['Color class'] = color_classes(county_shootings[rate], COLOR_BUCKETS)
+        county_fields.append('Color class')
+        color_field = 'Color class:O'
+    county_shootings[rate] = county_shootings[rate].round(VALUE_PRECISION)
 
 
     #--------------- CHOROPLETH PLOTTING ---------------#
 
-    USA_counties = alt.topo_feature(data.us_10m.url, 'counties')
+    USA_states = alt.topo_feature(TOPOLOGY_URL, 'states')
+    USA_counties = alt.topo_feature(TOPOLOGY_URL, 'counties')
 
     county_shootings_map = alt.Chart(USA_counties
     ).transform_lookup(
         lookup = 'id',
-        from_ = alt.LookupData(county_shootings, 'County FIPS', list(county_shootings.columns))
+        from_ = lookup_data(county_shootings, 'County FIPS', county_fields)
     ).mark_geoshape().encode(
         color = alt.Color(
-            'Shootings per 100K habitants:Q',
+            color_field,
             legend=alt.Legend(
                 title='Shootings per 100K Habitants',
                 titleColor='black',
@@ -300,10 +857,8 @@ def second_question(mass_shootings, county_population, counties_gdf):
         type = 'albersUsa'
     )
 
+    # only the state borders are drawn, no data needed
     state_shape_overlay = alt.Chart(USA_states
-    ).transform_lookup(
-        lookup = 'id',
-        from_ = alt.LookupData(state_shootings, 'FIPS', list(state_shootings.columns))
     ).mark_geoshape(
         stroke = 'gray',
         fill = 'transparent'
@@ -314,13 +869,13 @@ def second_question(mass_shootings, county_population, counties_gdf):
     county_shootings_overlay = alt.Chart(USA_counties
     ).transform_lookup(
         lookup = 'id',
-        from_ = alt.LookupData(county_shootings, 'County FIPS', list(county_shootings.columns))
+        from_ = lookup_data(county_shootings, 'County FIPS', county_fields)
     ).mark_geoshape(
         stroke='lightgray',
         fill = 'transparent'
     ).encode(
         color = alt.Color(
-            'Shootings per 100K habitants:Q',
+            color_field,
             legend=alt.Legend(
                 title="Shootings per 100K habitants",
                 titleColor='black',
@@ -343,120 +898,147 @@ def second_question(mass_shootings, county_population, counties_gdf):
         width='container', 
         height = 400         
     )
-    
-
 
-    ############# SUSPECTS KILLED/INJURED PER STATES #############
-
-    #--------------- CHOROPLETH PLOTTING ---------------#
-
-    Qextra_injured_map_final = alt.Chart(USA_states
-    ).transform_lookup(
-        lookup = 'id',
-        from_ = alt.LookupData(state_shootings, 'FIPS', list(state_shootings.columns))
-    ).mark_geoshape(stroke='darkgray'
-    ).encode(
-        color=alt.Color(
-        '% of Suspects Injured:Q',
-        legend=alt.Legend(
-            title= '% of Suspects Injured',
-            titleColor='black',
-            labelColor='black',
-            orient='top'
-        ),
-        scale=alt.Scale(scheme='lighttealblue')
-    ),
-        tooltip = ['State:N', '% of Suspects Injured:Q']
-    ).properties(
-        title = alt.TitleParams(
-            text = 'Percentage of Suspects Injured per shooting, by state',
-            fontSize = 18,
-            fontWeight='bold',
-            color = 'black'),
-        autosize='fit',
-        width='container',
-        height = 450
-    ).project(
-        type = 'albersUsa'
-    )
-
-
-    Qextra_killed_map_final = alt.Chart(USA_states
-    ).transform_lookup(
-        lookup = 'id',
-        from_ = alt.LookupData(state_shootings, 'FIPS', list(state_shootings.columns))
-    ).mark_geoshape(stroke='darkgray'
-    ).encode(
-        color=alt.Color(
-        '% of Suspects Killed:Q',
-        legend=alt.Legend(
-            title= '% of Suspects Killed',
-            titleColor='black',
-            labelColor='black',
-            orient='top'
-        ),
-        scale=alt.Scale(scheme='lighttealblue')
-    ),
-        tooltip = ['State:N', '% of Suspects Killed:Q']
-    ).properties(
-        title = alt.TitleParams(
-            text = 'Percentage of suspects killed per shooting, by state',
-            fontSize = 18,
-            fontWeight='bold',
-            color = 'black'),
-        autosize='fit',
-        width='container',
-        height = 450
-    ).project(
-        type = 'albersUsa'
-    )
-
-    return Q2_state_map_final, Q2_county_map_final, Qextra_injured_map_final, Qextra_killed_map_final
+    return Q2_county_map_final
 
 
 ############# QUESTION 3 #############
-def third_question(mass_shootings, school_incidents):
+SCHOOL_INCIDENTS_START = '2022-11'
+
+# the regression of the scatter plot is fitted here instead of by Vega in the browser: the chart gets one row per
+# state plus REGRESSION_POINTS points of the fitted line and of its confidence band; with REGION_FITS, a line
+# is also fitted to the states of each census region
+REGRESSION_POINTS = 25
+REGRESSION_CONFIDENCE = 0.95
+REGION_FITS = False
+
+def t_quantile(p, dof):
+    """Quantile of Student's t distribution: exact up to 2 degrees of freedom, Cornish-Fisher expansion above."""
+    if dof == 1:
+        return np.tan(np.pi * (p - 0.5))
+    if dof == 2:
+        return (2 * p - 1) / np.sqrt(2 * p * (1 - p))
+    z = NormalDist().inv_cdf(p)
+    terms = [(z**3 + z) / 4,
+             (5 * z**5 + 16 * z**3 + 3 * z) / 96,
+             (3 * z**7 + 19 * z**5 + 17 * z**3 - 15 * z) / 384,
+             (79 * z**9 + 776 * z**7 + 1482 * z**5 - 1920 * z**3 - 945 * z) / 92160]
+    return z + sum(term / dof**power for power, term in enumerate(terms, start=1))
+
+
+def linear_fit(x, y, n_points=REGRESSION_POINTS, confidence=REGRESSION_CONFIDENCE):
+    """Least-squares line of y on x and the Pearson correlation of x and y.
+
+    The line is given as n_points points over the range of x, with the confidence band of the mean response
+    ('Lower', 'Upper', NaN with only two points); it is None when x does not take two different values.
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    finite = np.isfinite(x) & np.isfinite(y)
+    x, y = x[finite], y[finite]
+    n = len(x)
+    if n < 2:
+        return None, np.nan
+    x_mean, y_mean = x.mean(), y.mean()
+    sxx, syy, sxy = ((x - x_mean)**2).sum(), ((y - y_mean)**2).sum(), ((x - x_mean) * (y - y_mean)).sum()
+    if sxx == 0:
+        return None, np.nan
+
+    slope = sxy / sxx
+    intercept = y_mean - slope * x_mean
+    correlation = sxy / np.sqrt(sxx * syy) if syy > 0 else np.nan
+
+    grid = np.linspace(x.min(), x.max(), n_points)
+    fitted = intercept + slope * grid
+    margin = np.full(n_points, np.nan)
+    if n > 2:
+        residual_sd = np.sqrt(((y - intercept - slope * x)**2).sum() / (n - 2))
+        margin = t_quantile((1 + confidence) / 2, n - 2) * residual_sd * np.sqrt(1 / n + (grid - x_mean)**2 / sxx)
+    line = pd.DataFrame({'x': grid, 'y': fitted, 'Lower': fitted - margin, 'Upper': fitted + margin})
+    return line, correlation
+
+
+@profiled
+def third_question(mass_shootings, school_incidents, cube=None, school_counts=None, months=None, state_shootings=None):
     """Scatter plot for the quantity of mass_shootings and school incidents per state"""
     
     #--------------- DATA PREPARATION ---------------#
-    mass_shootings['Incident Date'] = pd.to_datetime(mass_shootings['Incident Date'])
-    mass_shootings_reduced = mass_shootings[mass_shootings['Incident Date'] > '2022-11-01']
-
-
-    shootings_count = mass_shootings_reduced.groupby('State').size().reset_index(name="Shootings_count")
-    school_count = school_incidents.groupby('State').size().reset_index(name="School_count")
+    if cube is None:
+        cube = monthly_counts(mass_shootings)
+    if state_shootings is None:
+        state_shootings = aggregate_states(mass_shootings)
+
+    # the school incidents dataset starts in November 2022
+    first_month, last_month = months or (None, None)
+    first_month = max(first_month or SCHOOL_INCIDENTS_START, SCHOOL_INCIDENTS_START)
+    shootings_count = counts_since(cube, first_month, last_month).rename_axis('State').reset_index(name="Shootings_count")
+    if school_counts is None:
+        school_counts = school_tallies(school_incidents)
+    school_count = school_counts.rename_axis('State').reset_index(name="School_count")
     total_count = pd.merge(shootings_count, school_count, on='State', how='outer')
+    total_count['State'] = total_count['State'].astype(str) # the chart gets plain state names
     total_count = total_count.fillna(0)
 
-    total_count = total_count.merge(mass_shootings[['State','Population']], on = "State", how = "left")
-    total_count.loc[total_count['State'] == "Wyoming", 'Population'] = 584057.0
-    total_count.loc[total_count['State'] == "Montana", 'Population'] = 1122878.0
-    total_count.loc[total_count['State'] == "Vermont", 'Population'] = 643077.0
+    # one row per state: the populations come from the state table, which includes the states without incidents
+    total_count['Population'] = total_count['State'].map(state_shootings.set_index('State')['Population'])
 
     total_count['Ratio Mass Shootings'] = (total_count['Shootings_count']/total_count['Population'])*10**6
     total_count['Ratio School Incidents'] = (total_count['School_count']/total_count['Population'])*10**6
+
+    line, correlation = linear_fit(total_count['Ratio Mass Shootings'], total_count['Ratio School Incidents'])
+    region_lines = []
+    if REGION_FITS:
+        regions = {state: region for region, states in CENSUS_REGIONS.items() for state in states}
+        total_count['Region'] = total_count['State'].map(regions).fillna('Other')
+        for region, states in total_count.groupby('Region'):
+            region_line, _ = linear_fit(states['Ratio Mass Shootings'], states['Ratio School Incidents'])
+            if region_line is not None:
+                region_lines.append(region_line[['x', 'y']].assign(Region = region))
+
+    fit_fields = {'x': 'Ratio Mass Shootings', 'y': 'Ratio School Incidents'}
     
 
     #--------------- SCATTER PLOT PLOTTING ---------------#
 
-    scatter_plot = alt.Chart(total_count).mark_circle(color='#1f78b4').encode(
-        alt.X('Ratio Mass Shootings:Q', title = "Mass Shootings per million citizens", axis = alt.Axis(titleColor = 'black', labelColor = 'black', titleFontSize = 14, labelFontSize = 12)),
-        alt.Y('Ratio School Incidents:Q', title = "School Incidents per million citizens", axis = alt.Axis(titleColor = 'black', labelColor = 'black', titleFontSize = 14, labelFontSize = 12)),
+    x_axis = alt.X('Ratio Mass Shootings:Q', title = "Mass Shootings per million citizens", axis = alt.Axis(titleColor = 'black', labelColor = 'black', titleFontSize = 14, labelFontSize = 12))
+    y_title = "School Incidents per million citizens"
+    y_axis = alt.Y('Ratio School Incidents:Q', title = y_title, axis = alt.Axis(titleColor = 'black', labelColor = 'black', titleFontSize = 14, labelFontSize = 12))
+
+    point_fields = ['State', 'Ratio Mass Shootings', 'Ratio School Incidents'] + (['Region'] if REGION_FITS else [])
+    scatter_plot = alt.Chart(total_count[point_fields]).mark_circle(color='#1f78b4').encode(
+        x_axis,
+        y_axis,
         tooltip=['State', 'Ratio Mass Shootings', 'Ratio School Incidents']
-    ).properties(
+    )
+    if REGION_FITS:
+        scatter_plot = scatter_plot.encode(color = alt.Color('Region:N', legend=alt.Legend(titleColor='black', labelColor='black')))
+
+    layers = [scatter_plot]
+    if line is not None:
+        line = line.rename(columns=fit_fields)
+        confidence_band = alt.Chart(line).mark_area(color='#a6cee3', opacity=0.3).encode(
+            x_axis,
+            alt.Y('Lower:Q', title = y_title),
+            alt.Y2('Upper:Q')
+        )
+        linear_regression = alt.Chart(line).mark_line(color ='#a6cee3').encode(x_axis, y_axis)
+        layers = [confidence_band, scatter_plot, linear_regression]
+
+    if region_lines:
+        region_regressions = alt.Chart(pd.concat(region_lines).rename(columns=fit_fields)).mark_line(strokeDash=[4, 2]).encode(
+            x_axis,
+            y_axis,
+            color = 'Region:N'
+        )
+        layers.append(region_regressions)
+
+    Q3_scatterplot_final = alt.layer(*layers).properties(
         title = alt.TitleParams(
             text = 'Relationship Between Mass Shootings and School Incidents',
+            subtitle = f'Pearson correlation: {correlation:.2f}' if np.isfinite(correlation) else alt.Undefined,
+            subtitleColor = 'black',
             fontSize = 18,
             fontWeight='bold',
-            color = 'black')
-    )
-
-    linear_regression = scatter_plot.transform_regression(
-        'Ratio Mass Shootings',
-        'Ratio School Incidents'
-    ).mark_line(color ='#a6cee3')
-
-    Q3_scatterplot_final = alt.layer(scatter_plot, linear_regression).properties(
+            color = 'black'),
         autosize='fit',   
         width='container', 
         height = 400         
@@ -467,19 +1049,41 @@ def third_question(mass_shootings, school_incidents):
 
 
 ############# QUESTION 4 #############
-def fourth_question(mass_shootings):
+@profiled
+def fourth_question(mass_shootings, cube=None, months=None):
     """" Line chart to show the mass shootings envolved the last years in the USA"""
 
     #--------------- DATA PREPARATION ---------------#
 
-    mass_shootings['Incident Date'] = pd.to_datetime(mass_shootings['Incident Date'], errors= 'coerce')
-    mass_shootings['Year_Month'] = mass_shootings['Incident Date'].dt.to_period('M')
-    
+    if cube is None:
+        cube = monthly_counts(mass_shootings)
+
     # to have monthly total shootings
-    total_shootings = mass_shootings.groupby('Year_Month').size().reset_index(name = 'Count')
+    total_shootings = cube.sum(axis=0).reset_index(name = 'Count')
     total_shootings['Year_Month'] = total_shootings['Year_Month'].dt.to_timestamp()
     total_shootings = total_shootings[1 : -1] # deleting the first and last month that are incomplete
-
+    first_month, last_month = months or (None, None)
+    if first_month is not None:
+        total_shootings = total_shootings[total_shootings['Year_Month'] >= pd.Period(first_month, 'M').to_timestamp()]
+    if last_month is not None:
+        total_shootings = total_shootings[total_shootings['Year_Month'] <= pd.Period(last_month, 'M').to_timestamp()]
+
+    if total_shootings.empty:
+        # the range only holds the incomplete first or last month
+        return alt.Chart(total_shootings).mark_line().encode(
+            alt.X('Year_Month:T', title = 'Month - Year'),
+            alt.Y('Count:Q', title = 'Mass shootings'),
+        ).properties(
+            title = alt.TitleParams(
+                text = 'Mass shootings during the last four years in the USA',
+                subtitle = 'No complete month in the selected range',
+                fontSize = 18,
+                fontWeight='bold',
+                color = 'black'),
+            autosize='fit',
+            width='container',
+            height = 400
+        )
 
     max_value = total_shootings['Count'].max()
     min_value = total_shootings['Count'].min()
@@ -558,40 +1162,358 @@ def fourth_question(mass_shootings):
 
 
 
-def main():
-    mass_shootings = pd.read_csv('MassShootings.csv')
-    county_population = pd.read_csv('CountyPopulation.csv')
-    counties_gdf = gpd.read_file('Counties.geojson')
-    school_incidents = pd.read_csv('SchoolIncidents.csv')
+############# CHART CONSTRUCTION #############
+# none of the question functions modify their inputs, so the charts can also be built concurrently, with
+# executor='thread' or 'process'; most of the time goes into Altair building and validating the specs in pure
+# Python, which only worker processes (not threads) run in parallel. Both pools are opt-in: their gain on
+# multi-core hosts has not been measured, and on a single core they are only overhead
+
+CHART_EXECUTOR = None
+
+@st.cache_resource(show_spinner=False)
+def chart_pool(executor, max_workers):
+    """Worker pool kept for the life of the server, shared by all sessions and reruns."""
+    if executor == 'process':
+        # spawned, not forked: there is no fork on Windows, and forking the threaded Streamlit server is unsafe
+        return ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context('spawn'))
+    return ThreadPoolExecutor(max_workers)
+
+
+def build_charts(mass_shootings, county_population, counties_gdf, school_incidents, state_shootings, county_assignment, cube,
+                 county_counts=None, school_counts=None, months=None, executor=CHART_EXECUTOR, max_workers=None):
+    """All dashboard charts by name, built in sequence (executor=None) or in a 'thread' / 'process' pool.
+
+    months: optional (first, last) 'YYYY-MM' range of the time-based charts; the tallies passed in are already filtered.
+    """
+    tasks = {
+        'Q1': (first_question, (mass_shootings, state_shootings)),
+        'Q2 states': (second_question_states, (state_shootings,)),
+        'Q2 counties': (second_question_counties, (mass_shootings, county_population, counties_gdf, county_assignment, county_counts)),
+        'Q3': (third_question, (mass_shootings, school_incidents, cube, school_counts, months, state_shootings)),
+        'Q4': (fourth_question, (mass_shootings, cube, months)),
+    }
+
+    if executor is None:
+        results = {name: function(*args) for name, (function, args) in tasks.items()}
+    else:
+        pool = chart_pool(executor, max_workers or min(len(tasks), os.cpu_count() or 1))
+        # the process workers import this file as a module: the script run by Streamlit lives in a '__main__'
+        # they do not have, so tasks go through the module's _run_task and name their function
+        run_task = _importable_module()._run_task if executor == 'process' else _run_task
+        futures = {name: pool.submit(run_task, function.__name__, args, profiling()) for name, (function, args) in tasks.items()}
+        results = {}
+        for name, future in futures.items():
+            results[name], records = future.result()
+            if profiling():
+                # stages timed on a worker are recorded there
+                _profile.records.extend(records)
+
+    Q2_state_map_final, Qextra_injured_map_final, Qextra_killed_map_final = results['Q2 states']
+    return {
+        'Q1_barchart_final': results['Q1'],
+        'Q2_state_map_final': Q2_state_map_final,
+        'Q2_county_map_final': results['Q2 counties'],
+        'Q3_scatterplot_final': results['Q3'],
+        'Q4_linechart_final': results['Q4'],
+        'Qextra_injured_map_final': Qextra_injured_map_final,
+        'Qextra_killed_map_final': Qextra_killed_map_final,
+    }
+
+
+
+def _importable_module():
+    """This file imported as a regular module, as spawned workers (which inherit sys.path) import it too."""
+    directory, filename = os.path.split(os.path.abspath(__file__))
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    return importlib.import_module(os.path.splitext(filename)[0])
+
+
+def _run_task(function_name, args, profile=False):
+    """Result of a chart task plus the profile records it produced (when profiled)."""
+    if not profile:
+        return globals()[function_name](*args), []
+    start_profiling()
+    try:
+        result = globals()[function_name](*args)
+        return result, profile_records()
+    finally:
+        stop_profiling()
+
+
+
+############# DATA LOADING #############
+# parsed files are memoized across reruns and sessions; the cache key includes the file's
+# modification time and size, so a refreshed dataset is re-read on the next interaction
+# and stale entries are evicted once max_entries is reached;
+# typed Feather copies written by 'python ingest.py binary' are preferred while they are up to date. They are
+# memory-mapped and shared rather than copied to each caller: the numeric columns without nulls stay views of the
+# mapped file, so every session and every dashboard process reading the same copy uses the same page-cache pages
+
+def file_version(path):
+    """(mtime, size) of a file, used to invalidate cached parses when it changes."""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def replace_file(path, write):
+    """Replaces path with the file write(temporary path) produces, so readers never see it half written."""
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    os.close(handle)
+    try:
+        write(temporary)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _read_csv(path, version, categories):
+    return pd.read_csv(path, dtype={column: 'category' for column in categories})
+
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def _read_geojson(path, version):
+    return gpd.read_file(path)
+
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _read_feather(path, version):
+    # split_blocks keeps pandas from consolidating the zero-copy columns into new arrays; the mapped
+    # columns are read-only, and the pipeline only ever derives new frames from them
+    return feather.read_table(path, memory_map=True).to_pandas(split_blocks=True)
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _read_geofeather(path, version):
+    # geometries are decoded from WKB into new objects, only this decoded copy is shared
+    return gpd.read_feather(path, memory_map=True)
+
+
+def binary_copy(path):
+    """Path of the Feather copy of a dataset, or None when it is missing or older than the source."""
+    binary_path = os.path.splitext(path)[0] + '.feather'
+    if os.path.exists(binary_path) and os.path.getmtime(binary_path) >= os.path.getmtime(path):
+        return binary_path
+    return None
+
+
+def load_csv(path, categories=()):
+    """Parsed dataset; the given columns are read as Categoricals (the Feather copies store 'State' that way)."""
+    with stage(f'load {path}') as record:
+        binary_path = binary_copy(path)
+        if binary_path is not None:
+            df = _read_feather(binary_path, file_version(binary_path))
+        else:
+            df = _read_csv(path, file_version(path), tuple(categories))
+        record['rows'] = len(df)
+    return df
+
+
+def load_incident_tables():
+    """MassShootings.csv and SchoolIncidents.csv, their 'State' columns sharing the same categories."""
+    mass_shootings = load_csv('MassShootings.csv', categories=['State'])
+    school_incidents = load_csv('SchoolIncidents.csv', categories=['State'])
+    return with_state_codes(state_dtype(mass_shootings, school_incidents), mass_shootings, school_incidents)
+
+
+def load_geojson(path):
+    with stage(f'load {path}') as record:
+        binary_path = binary_copy(path)
+        if binary_path is not None:
+            counties_gdf = _read_geofeather(binary_path, file_version(binary_path))
+        else:
+            counties_gdf = _read_geojson(path, file_version(path))
+        record['rows'] = len(counties_gdf)
+    return counties_gdf
+
+
+
+############# PIPELINE STATE #############
+# the tables, the county assignment and the tallies the charts are built from are prepared once per version of
+# the files they come from and shared by every rerun and session (the question functions never modify them);
+# the versions also key the memoized chart specs, so new incidents or an 'aggregates --rebuild' are picked up.
+# Preparing may store the county assignment and the tallies, so the data is kept under the versions from
+# before and after those writes, and the next rerun does not prepare it again; sessions arriving together
+# after a change wait for a single preparation instead of each running (and storing) it
+
+PIPELINE_INPUTS = ['MassShootings.csv', 'SchoolIncidents.csv', 'CountyPopulation.csv', 'Counties.geojson',
+                   COUNTY_ASSIGNMENT_PATH, AGGREGATES_PATH]
+
+def pipeline_version():
+    """(mtime, size) of every pipeline input, None for the stored ones not written yet."""
+    return tuple(file_version(path) if os.path.exists(path) else None for path in PIPELINE_INPUTS)
+
+
+@st.cache_resource(show_spinner=False)
+def _prepared_data():
+    # pipeline version -> prepared data, only for the latest data, and the lock guarding it
+    return {}, threading.Lock()
+
+
+def prepare_data(version=None):
+    """Datasets, county assignment and up to date tallies, for the current file versions unless given.
+
+    'version' holds the file versions once the county assignment and the tallies are stored.
+    """
+    version = version or pipeline_version()
+    prepared, lock = _prepared_data()
+    with lock:
+        if version in prepared:
+            return prepared[version]
+        mass_shootings, school_incidents = load_incident_tables()
+        counties_gdf = load_geojson('Counties.geojson')
+        county_assignment = update_county_assignment(mass_shootings, counties_gdf)
+        data = {
+            'mass_shootings': mass_shootings,
+            'school_incidents': school_incidents,
+            'county_population': county_dimension(load_csv('CountyPopulation.csv')),
+            'counties_gdf': counties_gdf,
+            'county_assignment': county_assignment,
+            'aggregates': refresh_aggregates(mass_shootings, school_incidents, county_assignment),
+            'version': pipeline_version(),
+        }
+        prepared.clear()
+        prepared[version] = prepared[data['version']] = data
+        return data
+
+
+def compute_charts(first_month=None, last_month=None, states=None, version=None):
+    """All dashboard charts, computed from the datasets for the incidents between two months in the given states."""
+    data = prepare_data(version)
+    with stage('query aggregates'):
+        query = query_aggregates(data['aggregates'], first_month, last_month, states)
+
+    with stage('build_charts'):
+        return build_charts(data['mass_shootings'], data['county_population'], data['counties_gdf'], data['school_incidents'],
+                            query['states'], data['county_assignment'], query['months'], query['counties'], query['schools'],
+                            (first_month, last_month))
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def chart_specs(version, first_month=None, last_month=None, states=None):
+    """Vega-Lite specs of all charts by name, memoized for the 32 most recent filters and file versions."""
+    charts = compute_charts(first_month, last_month, states, version)
+    with stage('serialize charts'):
+        return {name: chart.to_dict() for name, chart in charts.items()}
+
+
+
+############# SNAPSHOTS #############
+# 'python ingest.py snapshot' renders every chart to static/snapshots/<version>/, the version being a hash of
+# the datasets, the map assets and this script; while nothing of that changes the app serves those
+# Vega-Lite specs instead of running the pipeline, and the SVG/PNG copies are plain static files
+
+SNAPSHOT_DIR = os.path.join('static', 'snapshots')
+SNAPSHOT_INPUTS = ['MassShootings.csv', 'CountyPopulation.csv', 'Counties.geojson', 'SchoolIncidents.csv',
+                   os.path.join('static', 'us_topology.json'), COUNTY_FIPS_PATH, __file__]
+CHART_NAMES = ['Q1_barchart_final', 'Q2_state_map_final', 'Q2_county_map_final', 'Q3_scatterplot_final',
+               'Q4_linechart_final', 'Qextra_injured_map_final', 'Qextra_killed_map_final']
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def _content_hash(paths, versions):
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def dataset_version(paths=SNAPSHOT_INPUTS):
+    """Content hash of everything the charts depend on, only recomputed when one of the files changes."""
+    return _content_hash(tuple(paths), tuple(file_version(path) for path in paths))
+
+
+def load_snapshot(version, directory=SNAPSHOT_DIR):
+    """Vega-Lite specs of all charts by name for a dataset version, or None when it was not exported."""
+    paths = {name: os.path.join(directory, version, f'{name}.vl.json') for name in CHART_NAMES}
+    if not all(os.path.exists(path) for path in paths.values()):
+        return None
+    with stage('load snapshot'):
+        charts = {}
+        for name, path in paths.items():
+            with open(path) as f:
+                charts[name] = json.load(f)
+    return charts
+
+
+
+############# FILTERS #############
+def chart_filters(aggregates):
+    """Sidebar controls for the month range and the states; returns only the filters that are set."""
+    months = [str(month) for month in aggregates['months'].columns]
+    states = sorted(set(aggregates['states'].index) | set(MISSING_STATES))
+    with st.sidebar:
+        first_month, last_month = st.select_slider('Months', options=months, value=(months[0], months[-1]),
+                                                   format_func=lambda month: pd.Period(month, 'M').strftime('%b %Y'))
+        selected_states = st.multiselect('States', states, placeholder='All states')
+
+    filters = {}
+    if (first_month, last_month) != (months[0], months[-1]):
+        filters.update(first_month=first_month, last_month=last_month)
+    if selected_states:
+        filters['states'] = tuple(sorted(selected_states))
+    return filters
 
+
+
+def main():
     st.set_page_config(layout = 'wide')
+    if st.query_params.get('profile') == '1':
+        st.session_state['profile'] = True
+    profile = PROFILING or st.session_state.get('profile', False)
+    if profile:
+        start_profiling()
+    try:
+        dashboard(profile)
+    finally:
+        if profile:
+            stop_profiling()
+
+
+def dashboard(profile=False):
+
     st.markdown('##  Analysis of Mass Shootings in the US')
     st.markdown('**Authors:** Raquel Jolis Carné and Martina Massana Massip')
 
-    Q1_barchart_final = first_question(mass_shootings)
-    Q2_state_map_final, Q2_county_map_final, Qextra_injured_map_final, Qextra_killed_map_final = second_question(mass_shootings, county_population, counties_gdf)
-    Q3_scatterplot_final = third_question(mass_shootings, school_incidents)
-    Q4_linechart_final = fourth_question(mass_shootings)
+    # the controls come from the tallies the charts are built from, so new months and states appear with them
+    filters = chart_filters(prepare_data()['aggregates'])
+
+    # the snapshots only cover the unfiltered dashboard
+    charts = None if filters else load_snapshot(dataset_version())
+    if charts is None:
+        charts = chart_specs(prepare_data()['version'], **filters)
+
+    def show(name):
+        # the charts are Vega-Lite specs already, whether snapshots or memoized
+        with stage(f'render {name}'):
+            st.vega_lite_chart(charts[name], use_container_width=True)
     
     barchart, spacer, maps = st.columns([1, 0.1, 1.2])
     with barchart: 
-        st.altair_chart(Q1_barchart_final, use_container_width=True)
+        show('Q1_barchart_final')
 
     with maps:
-        st.altair_chart(Q2_state_map_final, use_container_width=True)
-        st.altair_chart(Q2_county_map_final, use_container_width=True)
+        show('Q2_state_map_final')
+        show('Q2_county_map_final')
     
     linechart, spacer, scatterplot = st.columns([1.2, 0.1, 1])
     with linechart:
-        st.altair_chart(Q4_linechart_final, use_container_width=True)
+        show('Q4_linechart_final')
     with scatterplot:
-        st.altair_chart(Q3_scatterplot_final, use_container_width=True)
+        show('Q3_scatterplot_final')
     
     injured_plot, killed_plot = st.columns(2)
     with injured_plot: 
-        st.altair_chart(Qextra_injured_map_final, use_container_width=True)
+        show('Qextra_injured_map_final')
     with killed_plot:
-        st.altair_chart(Qextra_killed_map_final, use_container_width=True)
+        show('Qextra_killed_map_final')
+
+    if profile:
+        with st.expander('Pipeline profile'):
+            st.dataframe(pd.DataFrame(profile_records()), use_container_width=True)
     
 
 if __name__ =="__main__":
@@ -0,0 +1,186 @@
+"""Local HTTP/JSON API serving the dashboard aggregates, computed once and shared by every client.
+
+    python api.py [--host 127.0.0.1] [--port 8600]
+
+    GET /states     incidents, suspects and per-capita ratios per state
+    GET /counties   incidents and shootings per 100K habitants per county with incidents
+    GET /months     incidents per state and month
+    GET /version    version (content hash) of the datasets the aggregates come from
+
+The data endpoints take the dashboard filters as query parameters: first_month and last_month ('YYYY-MM', inclusive)
+and states (comma separated), e.g. /states?first_month=2023-01&states=Texas,Ohio. Every response has an ETag;
+a request whose If-None-Match lists it (or is '*') gets an empty 304 instead of the payload.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+from Jolis_Massana_FinalVisualitzation import (SNAPSHOT_INPUTS, county_dimension, dataset_version, file_version, load_csv,
+                                               load_geojson, load_incident_tables, query_aggregates, refresh_aggregates,
+                                               update_county_assignment)
+
+logger = logging.getLogger('dashboard.api')
+
+
+class AggregateStore:
+    """Aggregates of the current datasets, reloaded when an input file changes, with the encoded responses memoized."""
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self.versions = None
+        self.responses = OrderedDict()
+
+    def refresh(self):
+        versions = tuple(file_version(path) for path in SNAPSHOT_INPUTS)
+        if versions == self.versions:
+            return
+        mass_shootings, school_incidents = load_incident_tables()
+        county_assignment = update_county_assignment(mass_shootings, load_geojson('Counties.geojson'))
+        self.aggregates = refresh_aggregates(mass_shootings, school_incidents, county_assignment)
+        self.counties = county_dimension(load_csv('CountyPopulation.csv'))
+        self.version = dataset_version()
+        self.responses.clear()
+        self.versions = versions
+        logger.info('aggregates loaded for dataset version %s', self.version)
+
+    def response(self, path, first_month=None, last_month=None, states=None):
+        """(ETag, JSON body) for an endpoint and filters, or None for an unknown endpoint."""
+        self.refresh()
+        key = (path, first_month, last_month, states)
+        if key in self.responses:
+            self.responses.move_to_end(key)
+            return self.responses[key]
+
+        payload = self.payload(path, first_month, last_month, states)
+        if payload is None:
+            return None
+        body = payload.encode()
+        self.responses[key] = (f'"{hashlib.sha256(body).hexdigest()[:32]}"', body)
+        if len(self.responses) > self.max_entries:
+            self.responses.popitem(last=False)
+        return self.responses[key]
+
+    def payload(self, path, first_month, last_month, states):
+        if path == '/version':
+            return json.dumps({'version': self.version})
+        if path not in ('/states', '/counties', '/months'):
+            return None
+
+        query = query_aggregates(self.aggregates, first_month, last_month, states)
+        if path == '/states':
+            return query['states'].to_json(orient='records')
+
+        if path == '/counties':
+            counties = self.counties.join(query['counties'].rename('Total Shootings'), how='inner')
+            counties['Shootings per 100K habitants'] = counties['Total Shootings'] / counties['County Population'] * 10**5
+            return counties.rename_axis('County FIPS').reset_index().to_json(orient='records')
+
+        months = query['months']
+        in_window = pd.Series(True, index=months.columns)
+        if first_month is not None:
+            in_window &= months.columns >= pd.Period(first_month, 'M')
+        if last_month is not None:
+            in_window &= months.columns <= pd.Period(last_month, 'M')
+        counts = months.loc[:, in_window.to_numpy()].stack().rename('Count').reset_index()
+        counts['Year_Month'] = counts['Year_Month'].astype(str)
+        return counts[counts['Count'] > 0].to_json(orient='records')
+
+
+def request_filters(query_string):
+    """Dashboard filters from a query string; months are checked to be 'YYYY-MM'."""
+    params = {name: values[-1] for name, values in parse_qs(query_string).items()}
+    first_month, last_month = params.get('first_month'), params.get('last_month')
+    for month in (first_month, last_month):
+        if month is not None:
+            pd.Period(month, 'M') # raises ValueError
+    states = tuple(sorted(state.strip() for state in params['states'].split(',') if state.strip())) if params.get('states') else None
+    return first_month, last_month, states
+
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header ('*' or a list of possibly weak ETags) names the ETag."""
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    # GET requests use the weak comparison, a W/ prefix does not matter
+    return '*' in tags or etag in (tag.removeprefix('W/') for tag in tags)
+
+
+async def handle(reader, writer, store, executor):
+    try:
+        request_line = (await reader.readline()).decode('latin-1').split()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if len(request_line) != 3:
+            result = HTTPStatus.BAD_REQUEST, None, b''
+        elif request_line[0] not in ('GET', 'HEAD'):
+            result = HTTPStatus.METHOD_NOT_ALLOWED, None, b''
+        else:
+            target = urlsplit(request_line[1])
+            try:
+                filters = request_filters(target.query)
+            except ValueError as error:
+                result = HTTPStatus.BAD_REQUEST, None, json.dumps({'error': str(error)}).encode()
+            else:
+                # pandas work runs on the store's single worker thread, the event loop keeps accepting connections
+                cached = await asyncio.get_running_loop().run_in_executor(executor, store.response, target.path.rstrip('/') or '/', *filters)
+                if cached is None:
+                    result = HTTPStatus.NOT_FOUND, None, json.dumps({'error': f'unknown endpoint {target.path}'}).encode()
+                elif etag_matches(headers.get('if-none-match'), cached[0]):
+                    result = HTTPStatus.NOT_MODIFIED, cached[0], b''
+                else:
+                    result = HTTPStatus.OK, cached[0], cached[1]
+        status, etag, body = result
+
+        response_headers = [f'HTTP/1.1 {status.value} {status.phrase}', 'Content-Type: application/json',
+                            f'Content-Length: {len(body)}', 'Cache-Control: no-cache', 'Connection: close']
+        if etag is not None:
+            response_headers.append(f'ETag: {etag}')
+        writer.write(('\r\n'.join(response_headers) + '\r\n\r\n').encode('latin-1'))
+        if len(request_line) == 3 and request_line[0] == 'GET':
+            writer.write(body)
+        await writer.drain()
+    except Exception:
+        logger.exception('request failed')
+    finally:
+        writer.close()
+
+
+async def serve(host='127.0.0.1', port=8600, store=None):
+    store = store or AggregateStore()
+    executor = ThreadPoolExecutor(max_workers=1)
+    # the first request should not pay for loading the data
+    await asyncio.get_running_loop().run_in_executor(executor, store.refresh)
+    server = await asyncio.start_server(lambda reader, writer: handle(reader, writer, store, executor), host, port)
+    logger.info('serving the dashboard aggregates on http://%s:%d', host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8600)
+    parser.add_argument('--cache-entries', type=int, default=128, help='encoded responses kept in memory')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+    asyncio.run(serve(args.host, args.port, AggregateStore(args.cache_entries)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Benchmark of point-in-county assignment: geopandas sjoin against CountyLocator, with and without its coarse grid.
+
+Usage: python benchmarks/bench_county_lookup.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from Jolis_Massana_FinalVisualitzation import CountyLocator, prepare_counties
+
+
+def synthetic_points(n_points, seed=0):
+    """Points spread over the bounding box of the contiguous US, in the incident data's coordinate order."""
+    rng = np.random.default_rng(seed)
+    latitudes = rng.uniform(24.5, 49.5, n_points)
+    longitudes = rng.uniform(-125.0, -66.9, n_points)
+    # the incident data stores latitude first (see prepare_counties)
+    return latitudes, longitudes
+
+
+def sjoin_assign(points_x, points_y, counties_gdf):
+    points_gdf = gpd.GeoDataFrame(geometry=gpd.points_from_xy(points_x, points_y), crs=counties_gdf.crs)
+    geoids = points_gdf.sjoin(counties_gdf, how='left', predicate='within')['GEOID']
+    return pd.to_numeric(geoids).astype('Int32').array
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    raw_counties = gpd.read_file(os.path.join(ROOT, 'Counties.geojson'))
+    counties_gdf = prepare_counties(raw_counties)
+    locator, build_time = timed(CountyLocator, raw_counties, None)
+    print(f'CountyLocator built in {build_time:.3f} s')
+
+    gridded = CountyLocator(raw_counties)
+    _, grid_time = timed(gridded.build_grid)
+    print(f'coarse grid built in {grid_time:.3f} s ({(gridded.grid >= 0).mean():.0%} of the cells inside a county)')
+
+    x, y = synthetic_points(1)
+    _, single_time = timed(locator.locate_point, x[0], y[0])
+    print(f'single-point lookup: {single_time * 1e6:.0f} us')
+
+    print(f"{'points':>10} {'sjoin (s)':>10} {'exact (s)':>10} {'grid (s)':>9} {'speedup':>8}")
+    for n_points in args.sizes:
+        x, y = synthetic_points(n_points)
+        joined, sjoin_time = timed(sjoin_assign, x, y, counties_gdf)
+        located, locate_time = timed(locator.locate, x, y)
+        grid_located, grid_locate_time = timed(gridded.locate, x, y)
+
+        # all must place every point in the same county before their timings mean anything
+        assert pd.Series(located).equals(pd.Series(joined))
+        assert pd.Series(grid_located).equals(pd.Series(joined))
+
+        print(f'{n_points:>10,} {sjoin_time:>10.3f} {locate_time:>10.3f} {grid_locate_time:>9.3f} {sjoin_time / grid_locate_time:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
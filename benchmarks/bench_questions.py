@@ -0,0 +1,97 @@
+"""Benchmark of the dashboard pipeline on synthetic data: time, throughput and peak memory of every stage.
+
+Each size is generated with synthetic_data.py, written to a temporary directory and read back, so the
+CSV parsing and the incremental county assignment run as they do in the app; no Streamlit server or
+network access is needed.
+
+Usage: python benchmarks/bench_questions.py [--sizes 10000 100000 1000000] [--school-ratio 0.5]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+import altair as alt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from Jolis_Massana_FinalVisualitzation import (
+    aggregate_states, update_county_assignment, monthly_counts, first_question, second_question_states,
+    second_question_counties, third_question, fourth_question, start_profiling, profile_records, profile_logger, stage)
+from synthetic_data import load_reference, generate_incidents, generate_school_incidents
+
+
+def run_pipeline(directory, county_population, counties_gdf):
+    """The data preparation and chart construction of main(), each chart serialized to JSON as st.altair_chart does."""
+    with stage('read MassShootings.csv') as record:
+        mass_shootings = pd.read_csv(os.path.join(directory, 'MassShootings.csv'))
+        record['rows'] = len(mass_shootings)
+    with stage('read SchoolIncidents.csv') as record:
+        school_incidents = pd.read_csv(os.path.join(directory, 'SchoolIncidents.csv'))
+        record['rows'] = len(school_incidents)
+
+    state_shootings = aggregate_states(mass_shootings)
+    county_assignment = update_county_assignment(mass_shootings, counties_gdf, path=os.path.join(directory, 'MassShootings_Counties.csv'))
+    cube = monthly_counts(mass_shootings)
+
+    charts = {
+        'Q1': first_question(mass_shootings, state_shootings),
+        'Q2 states': second_question_states(state_shootings)[0],
+        'Q2 counties': second_question_counties(mass_shootings, county_population, counties_gdf, county_assignment),
+        'Q3': third_question(mass_shootings, school_incidents, cube, state_shootings=state_shootings),
+        'Q4': fourth_question(mass_shootings, cube),
+    }
+    spec_sizes = {}
+    # st.altair_chart does not enforce Altair's row limit, so neither does the benchmark
+    with alt.data_transformers.disable_max_rows():
+        for name, chart in charts.items():
+            with stage(f'serialize {name}', rows=len(mass_shootings)):
+                spec_sizes[name] = len(chart.to_json())
+    return spec_sizes
+
+
+def report(n_rows, records, spec_sizes):
+    print(f'\n{n_rows:,} incidents')
+    print(f"{'stage':<32} {'rows':>10} {'time (s)':>9} {'rows/s':>12} {'peak (MB)':>10}")
+    for record in records:
+        rows = record['rows'] or 0
+        throughput = f'{rows / record["seconds"]:,.0f}' if rows and record['seconds'] > 0 else '-'
+        print(f"{record['stage']:<32} {rows:>10,} {record['seconds']:>9.3f} {throughput:>12} {record['peak_mb']:>10.1f}")
+    print('spec size (KB): ' + ', '.join(f'{name} {size / 1024:,.0f}' for name, size in spec_sizes.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--school-ratio', type=float, default=0.5, help='school incidents generated per incident')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log', action='store_true', help='also print every stage record as a JSON line')
+    args = parser.parse_args()
+
+    counties_gdf, states = load_reference()
+    county_population = pd.read_csv(os.path.join(ROOT, 'CountyPopulation.csv'))
+    start_profiling()
+    if not args.log:
+        profile_logger.setLevel(logging.WARNING)
+
+    for n_rows in args.sizes:
+        start = time.perf_counter()
+        incidents = generate_incidents(n_rows, counties_gdf, states, args.seed)
+        school_incidents = generate_school_incidents(int(n_rows * args.school_ratio), counties_gdf, args.seed + 1)
+        with tempfile.TemporaryDirectory() as directory:
+            incidents.to_csv(os.path.join(directory, 'MassShootings.csv'), index=False)
+            school_incidents.to_csv(os.path.join(directory, 'SchoolIncidents.csv'), index=False)
+            del incidents, school_incidents
+            print(f'generated {n_rows:,} incidents in {time.perf_counter() - start:.1f} s')
+
+            first_record = len(profile_records())
+            spec_sizes = run_pipeline(directory, county_population, counties_gdf)
+            report(n_rows, profile_records()[first_record:], spec_sizes)
+
+
+if __name__ == '__main__':
+    main()
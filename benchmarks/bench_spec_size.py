@@ -0,0 +1,56 @@
+"""Size of the Vega-Lite spec sent to the browser for every dashboard chart, with and without compact lookups.
+
+Usage: python benchmarks/bench_spec_size.py
+"""
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import Jolis_Massana_FinalVisualitzation as dashboard
+
+
+def build_charts():
+    mass_shootings = dashboard.load_csv('MassShootings.csv')
+    county_population = dashboard.load_csv('CountyPopulation.csv')
+    counties_gdf = dashboard.load_geojson('Counties.geojson')
+    school_incidents = dashboard.load_csv('SchoolIncidents.csv')
+
+    state_shootings = dashboard.aggregate_states(mass_shootings)
+    county_assignment = dashboard.update_county_assignment(mass_shootings, counties_gdf)
+    cube = dashboard.monthly_counts(mass_shootings)
+
+    state_map, county_map, injured_map, killed_map = dashboard.second_question(mass_shootings, county_population, counties_gdf, state_shootings, county_assignment)
+    return {
+        'Q1 bar chart': dashboard.first_question(mass_shootings, state_shootings),
+        'Q2 state map': state_map,
+        'Q2 county map': county_map,
+        'Q3 scatter plot': dashboard.third_question(mass_shootings, school_incidents, cube, state_shootings=state_shootings),
+        'Q4 line chart': dashboard.fourth_question(mass_shootings, cube),
+        'Suspects injured map': injured_map,
+        'Suspects killed map': killed_map,
+    }
+
+
+def spec_sizes():
+    return {name: len(json.dumps(chart.to_dict(), separators=(',', ':'))) for name, chart in build_charts().items()}
+
+
+def main():
+    os.chdir(ROOT)
+
+    dashboard.COMPACT_LOOKUPS = False
+    before = spec_sizes()
+    dashboard.COMPACT_LOOKUPS = True
+    after = spec_sizes()
+
+    print(f"{'chart':<22} {'full (KB)':>10} {'compact (KB)':>13}")
+    for name in before:
+        print(f'{name:<22} {before[name] / 1024:>10.1f} {after[name] / 1024:>13.1f}')
+    print(f"{'total':<22} {sum(before.values()) / 1024:>10.1f} {sum(after.values()) / 1024:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Benchmark of the per-state aggregation: the original iterrows loop against aggregate_states.
+
+Usage: python benchmarks/bench_state_aggregation.py [--sizes 1000000 10000000] [--legacy-limit 1000000]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from Jolis_Massana_FinalVisualitzation import aggregate_states, MISSING_STATES
+
+
+def legacy_aggregate_states(mass_shootings):
+    """The row-by-row tally that second_question used before aggregate_states."""
+    state_shootings = {state: [0, 0, 0, 0, 0, 0] for state in set(mass_shootings['State'])}
+    for state, (fips, population) in MISSING_STATES.items():
+        state_shootings[state] = [fips, 0, population, 0, 0, 0]
+
+    for _, row in mass_shootings.iterrows():
+        current_state = row['State']
+        suspects_injured = row['Suspects Injured']
+        suspects_killed = row['Suspects Killed']
+        suspects_arrested = int(row['Suspects Arrested'])
+
+        state_shootings[current_state][0] = row['FIPS']
+        state_shootings[current_state][1] += 1
+        state_shootings[current_state][2] = row['Population']
+        state_shootings[current_state][3] += suspects_injured
+        state_shootings[current_state][4] += suspects_killed
+        state_shootings[current_state][5] += suspects_injured + suspects_killed + suspects_arrested
+
+    state_shootings = pd.DataFrame.from_dict(state_shootings, orient='index',
+                                             columns=['FIPS', 'Total Shootings', 'Population', 'Suspects Injured', 'Suspects Killed', 'Suspects'])
+    state_shootings = state_shootings.reset_index().rename(columns={'index': 'State'})
+    state_shootings['Shootings per 1M Habitants'] = state_shootings['Total Shootings'] / state_shootings['Population'] * 10**6
+    state_shootings['% of Suspects Injured'] = state_shootings['Suspects Injured'] / state_shootings['Suspects'] * 100
+    state_shootings['% of Suspects Killed'] = state_shootings['Suspects Killed'] / state_shootings['Suspects'] * 100
+    return state_shootings.fillna(0)
+
+
+def synthetic_incidents(n_rows, seed=0):
+    """Incident rows drawn from the states present in MassShootings.csv."""
+    states = pd.read_csv(os.path.join(ROOT, 'MassShootings.csv'), usecols=['State', 'FIPS', 'Population'])
+    states = states.drop_duplicates('State').reset_index(drop=True)
+
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(states), n_rows)
+    return pd.DataFrame({
+        'State': states['State'].to_numpy()[picks],
+        'FIPS': states['FIPS'].to_numpy()[picks],
+        'Population': states['Population'].to_numpy()[picks],
+        'Suspects Killed': rng.poisson(0.05, n_rows),
+        'Suspects Injured': rng.poisson(0.05, n_rows),
+        'Suspects Arrested': rng.poisson(0.3, n_rows),
+    })
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000_000, 10_000_000])
+    parser.add_argument('--legacy-limit', type=int, default=1_000_000,
+                        help='largest input the iterrows loop runs on; bigger sizes are extrapolated linearly')
+    args = parser.parse_args()
+
+    print(f"{'rows':>12} {'legacy (s)':>14} {'vectorized (s)':>15} {'speedup':>9}")
+    for n_rows in args.sizes:
+        incidents = synthetic_incidents(n_rows)
+
+        new, new_time = timed(aggregate_states, incidents)
+
+        legacy_rows = min(n_rows, args.legacy_limit)
+        old, old_time = timed(legacy_aggregate_states, incidents.iloc[:legacy_rows])
+        if legacy_rows == n_rows:
+            # both paths must agree before their timings mean anything
+            old = old.set_index('State').sort_index()
+            pd.testing.assert_frame_equal(new.set_index('State').sort_index()[old.columns], old, check_dtype=False)
+            legacy_label = f'{old_time:.2f}'
+        else:
+            old_time = old_time * n_rows / legacy_rows
+            legacy_label = f'~{old_time:.2f}'
+
+        print(f'{n_rows:>12,} {legacy_label:>14} {new_time:>15.3f} {old_time / new_time:>8.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Synthetic incident and school-incident datasets in the schemas of MassShootings.csv and SchoolIncidents.csv.
+
+Incidents are placed at random points inside real county polygons from Counties.geojson, counties being drawn
+in proportion to their population, so state, FIPS, coordinates and county assignment are all consistent.
+
+Usage: python benchmarks/synthetic_data.py 1000000 --output-dir /tmp/synthetic
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ingest import state_lookup
+
+
+STREETS = ['Main St', 'Oak Ave', 'Maple Dr', 'Washington Blvd', 'Park Rd', 'Lincoln Ave', 'Cedar Ln', 'Elm St']
+
+
+def load_reference(root=ROOT):
+    """Counties (without Puerto Rico) with their state name and 2023 population, plus the state lookup table."""
+    counties_gdf = gpd.read_file(os.path.join(root, 'Counties.geojson'))
+    counties_gdf = counties_gdf[counties_gdf['STATEFP'] != '72'].reset_index(drop=True)
+
+    states = state_lookup(os.path.join(root, 'CountyPopulation.csv'))
+    state_names = pd.Series(states.index, index=states['FIPS'].astype(int))
+
+    county_population = pd.read_csv(os.path.join(root, 'CountyPopulation.csv'), usecols=['FIPStxt', 'POP_ESTIMATE_2023'], thousands=',')
+    population = counties_gdf['GEOID'].astype(int).map(county_population.set_index('FIPStxt')['POP_ESTIMATE_2023'])
+
+    counties_gdf['State'] = counties_gdf['STATEFP'].astype(int).map(state_names)
+    counties_gdf['Population'] = population.fillna(population.median())
+    return counties_gdf, states
+
+
+def random_points_in(polygons, rng):
+    """One uniformly distributed point inside each polygon, by rejection sampling over the bounding boxes."""
+    shapely.prepare(polygons)
+    bounds = shapely.bounds(polygons)
+    x = np.empty(len(polygons))
+    y = np.empty(len(polygons))
+    pending = np.arange(len(polygons))
+    while len(pending) > 0:
+        minx, miny, maxx, maxy = bounds[pending].T
+        x_try = rng.uniform(minx, maxx)
+        y_try = rng.uniform(miny, maxy)
+        inside = shapely.contains_xy(polygons[pending], x_try, y_try)
+        x[pending[inside]] = x_try[inside]
+        y[pending[inside]] = y_try[inside]
+        pending = pending[~inside]
+    return x, y
+
+
+def random_dates(n_rows, start, end, rng):
+    days = (pd.Timestamp(end) - pd.Timestamp(start)).days
+    return pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, days + 1, n_rows), unit='D')
+
+
+def generate_incidents(n_rows, counties_gdf, states, seed=0, start='2021-07-28', end='2024-09-18'):
+    """Mass shooting incidents in the MassShootings.csv schema, newest first."""
+    rng = np.random.default_rng(seed)
+    weights = counties_gdf['Population'].to_numpy(dtype=float)
+    picks = rng.choice(len(counties_gdf), n_rows, p=weights / weights.sum())
+    counties = counties_gdf.iloc[picks]
+
+    longitudes, latitudes = random_points_in(counties.geometry.to_numpy(), rng)
+    dates = random_dates(n_rows, start, end, rng).sort_values(ascending=False)
+
+    state_names = counties['State'].to_numpy()
+    cities = counties['NAME'].to_numpy()
+    addresses = pd.Series(rng.integers(1, 99, n_rows) * 100).astype(str) + ' ' + pd.Series(np.array(STREETS)[rng.integers(0, len(STREETS), n_rows)])
+
+    incidents = pd.DataFrame({
+        'Incident ID': np.arange(3_100_000 + n_rows, 3_100_000, -1),
+        'Incident Date': dates.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'State': state_names,
+        'FIPS': states.loc[state_names, 'FIPS'].to_numpy(),
+        'Population': states.loc[state_names, 'Population'].to_numpy(),
+        'City Or County': cities,
+        'Address': addresses.to_numpy(),
+    })
+    incidents['Complete_Address'] = incidents['Address'] + ',' + incidents['City Or County'] + ',' + incidents['State']
+    # the dataset stores the latitude under 'Longitude' and the longitude under 'Latitude'
+    incidents['Longitude'] = latitudes
+    incidents['Latitude'] = longitudes
+    incidents['Victims Killed'] = rng.poisson(0.9, n_rows)
+    incidents['Victims Injured'] = rng.poisson(3.5, n_rows) + 1
+    incidents['Suspects Killed'] = rng.poisson(0.05, n_rows)
+    incidents['Suspects Injured'] = rng.poisson(0.05, n_rows)
+    incidents['Suspects Arrested'] = rng.poisson(0.3, n_rows)
+    return incidents
+
+
+def generate_school_incidents(n_rows, counties_gdf, seed=1, start='2022-11-01', end='2024-09-27'):
+    """School incidents in the SchoolIncidents.csv schema, newest first."""
+    rng = np.random.default_rng(seed)
+    weights = counties_gdf['Population'].to_numpy(dtype=float)
+    counties = counties_gdf.iloc[rng.choice(len(counties_gdf), n_rows, p=weights / weights.sum())]
+    dates = random_dates(n_rows, start, end, rng).sort_values(ascending=False)
+
+    return pd.DataFrame({
+        'Incident ID': np.arange(3_200_000 + n_rows, 3_200_000, -1),
+        'Incident Date': dates.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'State': counties['State'].to_numpy(),
+        'City Or County': counties['NAME'].to_numpy(),
+        'Victims Killed': rng.poisson(0.1, n_rows),
+        'Victims Injured': rng.poisson(0.3, n_rows),
+        'Suspects Killed': rng.poisson(0.02, n_rows),
+        'Suspects Injured': rng.poisson(0.02, n_rows),
+        'Suspects Arrested': rng.poisson(0.4, n_rows),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('incidents', type=int)
+    parser.add_argument('--school-incidents', type=int, help='defaults to the same number as incidents')
+    parser.add_argument('--output-dir', default='synthetic')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    counties_gdf, states = load_reference()
+    os.makedirs(args.output_dir, exist_ok=True)
+    generate_incidents(args.incidents, counties_gdf, states, args.seed).to_csv(os.path.join(args.output_dir, 'MassShootings.csv'), index=False)
+    n_school = args.school_incidents if args.school_incidents is not None else args.incidents
+    generate_school_incidents(n_school, counties_gdf, args.seed + 1).to_csv(os.path.join(args.output_dir, 'SchoolIncidents.csv'), index=False)
+    print(f'{args.incidents} incidents and {n_school} school incidents written to {args.output_dir}')
+
+
+if __name__ == '__main__':
+    main()
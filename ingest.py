@@ -0,0 +1,455 @@
+"""Data preparation steps for the dashboard.
+
+    python ingest.py raw MassShootings_RAW.csv out.csv   # raw export -> cleaned MassShootings.csv schema
+    python ingest.py binary                             # typed Feather copies of the CSVs and of Counties.geojson
+    python ingest.py topology                           # static/ map topology and county FIPS list for the charts
+    python ingest.py aggregates [--verify]              # stored chart tallies extended with the new incidents
+    python ingest.py snapshot                           # pre-rendered charts for the current datasets
+"""
+import argparse
+import importlib
+import json
+import os
+import re
+import sqlite3
+import time
+
+import pandas as pd
+import geopandas as gpd
+
+
+TABLES = ['MassShootings.csv', 'CountyPopulation.csv', 'SchoolIncidents.csv']
+COUNTIES = 'Counties.geojson'
+
+
+############# RAW INGESTION #############
+# raw exports are read in fixed-size chunks and every chunk is cleaned with vectorized column
+# operations and appended to the output, so memory use does not depend on the size of the export
+
+CLEAN_COLUMNS = ['Incident ID', 'Incident Date', 'State', 'FIPS', 'Population', 'City Or County', 'Address',
+                 'Complete_Address', 'Longitude', 'Latitude', 'Victims Killed', 'Victims Injured',
+                 'Suspects Killed', 'Suspects Injured', 'Suspects Arrested']
+
+def state_lookup(county_population_path='CountyPopulation.csv'):
+    """State name -> FIPS and 2020 census population, from the state-level rows of CountyPopulation.csv."""
+    states = pd.read_csv(county_population_path, usecols=['FIPStxt', 'Area_Name', 'CENSUS_2020_POP'], thousands=',')
+    states = states[states['FIPStxt'] % 1000 == 0] # state rows have county code 000
+    states = states.assign(FIPS = states['FIPStxt'] // 1000, Population = states['CENSUS_2020_POP'])
+    return states.set_index('Area_Name')[['FIPS', 'Population']].astype('Int64')
+
+
+def read_raw(raw_path, chunksize=100_000):
+    """Raw export as a stream of DataFrame chunks."""
+    with pd.read_csv(raw_path, chunksize=chunksize) as reader:
+        yield from reader
+
+
+def clean_chunk(raw, states, geocoder=None):
+    """One chunk of the raw export in the MassShootings.csv schema.
+
+    geocoder(complete_address) returns (latitude, longitude) or None. Incidents it cannot place are
+    dropped, as in MassShootings.csv; without a geocoder the coordinates are left empty.
+    """
+    chunk = raw.dropna(subset=['Address']).copy()
+
+    chunk['Incident Date'] = pd.to_datetime(chunk['Incident Date'], format='%B %d, %Y').dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+    chunk['Address'] = chunk['Address'].str.replace('block of', '', regex=False)
+    chunk['Complete_Address'] = chunk['Address'] + ',' + chunk['City Or County'] + ',' + chunk['State']
+
+    # state enrichment is a single join against the in-memory lookup table
+    chunk = chunk.join(states, on='State')
+
+    # MassShootings.csv stores the latitude under 'Longitude' and the longitude under 'Latitude'
+    # (second_question swaps the county polygons to match), so the same order is kept here
+    chunk['Longitude'] = float('nan')
+    chunk['Latitude'] = float('nan')
+    if geocoder is not None:
+        coordinates = [geocoder(address) for address in chunk['Complete_Address']]
+        chunk['Longitude'] = [c[0] if c is not None else None for c in coordinates]
+        chunk['Latitude'] = [c[1] if c is not None else None for c in coordinates]
+        chunk = chunk.dropna(subset=['Longitude', 'Latitude'])
+
+    return chunk[CLEAN_COLUMNS]
+
+
+def clean_chunks(raw_path, states, chunksize=100_000, geocoder=None):
+    for raw in read_raw(raw_path, chunksize):
+        yield clean_chunk(raw, states, geocoder)
+
+
+def ingest_raw(raw_path, output_path, county_population_path='CountyPopulation.csv', chunksize=100_000, geocoder=None,
+               county_locator=None, assignment_path=None):
+    """Stream a raw export into a cleaned CSV; returns the number of rows written.
+
+    With a county_locator (see CountyLocator in the dashboard), the county of every incident missing from the
+    stored assignment at assignment_path is located chunk by chunk and added to it once all chunks are written.
+    """
+    states = state_lookup(county_population_path)
+    assigned = set()
+    if county_locator is not None and os.path.exists(assignment_path):
+        assigned = set(pd.read_csv(assignment_path, usecols=['Incident ID'])['Incident ID'])
+
+    rows = 0
+    located = []
+    with open(output_path, 'w', newline='') as output:
+        for chunk in clean_chunks(raw_path, states, chunksize, geocoder):
+            chunk.to_csv(output, header=(rows == 0), index=False)
+            rows += len(chunk)
+            if county_locator is not None:
+                located.append(locate_new_counties(chunk, county_locator, assigned))
+                assigned |= set(located[-1]['Incident ID'])
+    if located:
+        add_county_assignment(assignment_path, pd.concat(located, ignore_index=True))
+    return rows
+
+
+def locate_new_counties(chunk, county_locator, assigned):
+    """County FIPS code of the incidents of a chunk whose Incident ID is not in assigned."""
+    new_incidents = chunk[~chunk['Incident ID'].isin(assigned)]
+    return pd.DataFrame({
+        'Incident ID': new_incidents['Incident ID'],
+        'GEOID': county_locator.locate(new_incidents['Longitude'], new_incidents['Latitude']),
+    })
+
+
+def add_county_assignment(assignment_path, counties):
+    """Adds the incidents not yet in the stored assignment, replacing the file as the dashboard does."""
+    from Jolis_Massana_FinalVisualitzation import replace_file
+
+    # re-read right before replacing, to keep what the dashboard stored while the chunks were processed; a row
+    # lost to a concurrent replace is only a missing assignment, which the dashboard locates again
+    if os.path.exists(assignment_path):
+        stored = pd.read_csv(assignment_path, dtype={'GEOID': 'Int32'})
+        counties = pd.concat([stored, counties[~counties['Incident ID'].isin(stored['Incident ID'])]], ignore_index=True)
+    replace_file(assignment_path, lambda temporary: counties.to_csv(temporary, index=False))
+
+
+
+############# GEOCODE CACHE #############
+# addresses are geocoded once and kept in a local SQLite file; failed lookups are cached too,
+# so a refresh only reaches the (slow, paid) geocoder for addresses it has never seen
+
+GEOCODE_CACHE = 'geocode_cache.sqlite'
+
+def normalize_address(address):
+    """Cache key of an address: lowercase, 'block of' prefix stripped, whitespace collapsed."""
+    address = re.sub(r'\bblock of\b', ' ', address.lower())
+    address = re.sub(r'\s*,\s*', ',', address)
+    return re.sub(r'\s+', ' ', address).strip()
+
+
+class GeocodeCache:
+    """Callable geocoder that answers from the on-disk cache and falls back to `geocoder` on a miss.
+
+    geocoder(address) returns (latitude, longitude) or None, like the geocoders clean_chunk accepts.
+    """
+
+    def __init__(self, path=GEOCODE_CACHE, geocoder=None, commit_every=1000):
+        self.geocoder = geocoder
+        self.commit_every = commit_every
+        self.hits = 0
+        self.misses = 0
+        self.pending = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS geocode (address TEXT PRIMARY KEY, latitude REAL, longitude REAL)')
+
+    def __call__(self, address):
+        key = normalize_address(address)
+        row = self.connection.execute('SELECT latitude, longitude FROM geocode WHERE address = ?', (key,)).fetchone()
+        if row is not None:
+            self.hits += 1
+            return None if row[0] is None else row
+
+        self.misses += 1
+        if self.geocoder is None:
+            return None
+
+        coordinates = self.geocoder(address)
+        self.store(key, coordinates)
+        return coordinates
+
+    def store(self, key, coordinates):
+        latitude, longitude = coordinates if coordinates is not None else (None, None)
+        self.connection.execute('INSERT OR REPLACE INTO geocode VALUES (?, ?, ?)', (key, latitude, longitude))
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.connection.commit()
+            self.pending = 0
+
+    def seed(self, cleaned_path):
+        """Cache the coordinates already present in a cleaned incidents file."""
+        cleaned = pd.read_csv(cleaned_path, usecols=['Complete_Address', 'Longitude', 'Latitude']).dropna()
+        # 'Longitude' holds the latitude in the cleaned files (see clean_chunk)
+        rows = [(normalize_address(a), lat, lon) for a, lat, lon in zip(cleaned['Complete_Address'], cleaned['Longitude'], cleaned['Latitude'])]
+        self.connection.executemany('INSERT OR REPLACE INTO geocode VALUES (?, ?, ?)', rows)
+        self.connection.commit()
+        return len(rows)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def import_geocoder(spec):
+    """Geocoder function from a 'module:function' path."""
+    module, function = spec.split(':')
+    return getattr(importlib.import_module(module), function)
+
+
+
+############# BINARY STORAGE #############
+# the dashboard reads '<name>.feather' instead of '<name>.csv' / '<name>.geojson' when it is newer than
+# the source file; Feather is written uncompressed, so loading it skips all text parsing and decompression
+
+def binary_path(path):
+    return os.path.splitext(path)[0] + '.feather'
+
+
+def typed_columns(df):
+    """Numeric columns stored as text ('5,024,279', '011.3', quoted '0') converted to numbers; ISO dates to datetimes; states to categories."""
+    df = df.copy()
+    for column in df.columns:
+        if df[column].dtype != object and not pd.api.types.is_string_dtype(df[column]):
+            continue
+        values = df[column].str.replace(',', '', regex=False)
+        numbers = pd.to_numeric(values, errors='coerce')
+        if numbers.notna().sum() == values.notna().sum() and values.notna().any():
+            # integer columns stay integers unless they have gaps
+            if numbers.notna().all() and (numbers % 1 == 0).all():
+                numbers = numbers.astype('int64')
+            df[column] = numbers
+
+    if 'Incident Date' in df.columns:
+        df['Incident Date'] = pd.to_datetime(df['Incident Date'])
+    # stored dictionary-encoded, read back as a Categorical
+    if 'State' in df.columns:
+        df['State'] = df['State'].astype('category')
+    return df
+
+
+def write_binary_table(csv_path):
+    from Jolis_Massana_FinalVisualitzation import replace_file
+
+    df = typed_columns(pd.read_csv(csv_path))
+    # replaced rather than overwritten, as a running dashboard keeps the previous copy memory-mapped
+    replace_file(binary_path(csv_path), lambda temporary: df.to_feather(temporary, compression='uncompressed'))
+    return df
+
+
+def write_binary_counties(geojson_path):
+    from Jolis_Massana_FinalVisualitzation import replace_file
+
+    counties_gdf = gpd.read_file(geojson_path)
+    # geometries are stored as WKB, so loading skips the JSON coordinate parsing
+    replace_file(binary_path(geojson_path), lambda temporary: counties_gdf.to_feather(temporary, compression='uncompressed'))
+    return counties_gdf
+
+
+def convert_all(directory='.'):
+    for name in TABLES:
+        df = write_binary_table(os.path.join(directory, name))
+        print(f'{name} -> {binary_path(name)} ({len(df)} rows)')
+    counties_gdf = write_binary_counties(os.path.join(directory, COUNTIES))
+    print(f'{COUNTIES} -> {binary_path(COUNTIES)} ({len(counties_gdf)} counties)')
+
+
+
+############# MAP TOPOLOGY #############
+# the choropleths read their state and county shapes from static/us_topology.json, served by the app itself,
+# instead of the us-10m TopoJSON on a public CDN; it is built from Counties.geojson, states being the union
+# of their counties, with feature ids set to the numeric FIPS codes the charts look up.
+# The arcs are simplified by TOPOLOGY_SIMPLIFY degrees (about 0.7 px on an 800 px wide map); as shared
+# arcs are simplified once, neighbouring counties and states still meet without gaps or overlaps
+
+STATIC_DIR = 'static'
+TOPOLOGY_SIMPLIFY = 0.05
+
+def build_topology(geojson_path=COUNTIES, output_dir=STATIC_DIR, quantization=1e5, simplify=TOPOLOGY_SIMPLIFY):
+    import topojson # only needed to rebuild the bundled assets
+
+    counties_gdf = gpd.read_file(geojson_path)
+    # dropping Puerto Rico, as the dashboard does
+    counties_gdf = counties_gdf[counties_gdf['STATEFP'] != '72']
+
+    counties = gpd.GeoDataFrame({'fips': counties_gdf['GEOID'].astype(int)}, geometry=counties_gdf.geometry.values, crs=counties_gdf.crs)
+    states_gdf = counties_gdf.dissolve('STATEFP').reset_index()
+    states = gpd.GeoDataFrame({'fips': states_gdf['STATEFP'].astype(int)}, geometry=states_gdf.geometry.values, crs=counties_gdf.crs)
+
+    topology = topojson.Topology([counties, states], object_name=['counties', 'states'], prequantize=quantization,
+                                 toposimplify=simplify).to_dict()
+    for obj in topology['objects'].values():
+        for geometry in obj['geometries']:
+            geometry['id'] = geometry.pop('properties')['fips']
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'us_topology.json'), 'w') as output:
+        json.dump(topology, output, separators=(',', ':'))
+
+    # all plottable county FIPS, in the column 'id'
+    counties[['fips']].rename(columns={'fips': 'id'}).sort_values('id').to_csv(os.path.join(output_dir, 'county_fips.csv'), index=False)
+    return len(counties), len(states)
+
+
+
+############# AGGREGATE STATE #############
+# nightly refresh: the stored tallies are extended with the incidents appended since the last run
+
+def refresh_stored_aggregates(path=None, rebuild=False, verify=False):
+    """Brings the stored tallies up to date; returns them with the names of any tallies failing verification."""
+    from Jolis_Massana_FinalVisualitzation import (AGGREGATES_PATH, load_incident_tables, load_geojson, load_aggregates,
+                                                   replace_file, update_aggregates, update_county_assignment,
+                                                   verify_aggregates)
+
+    path = path or AGGREGATES_PATH
+    mass_shootings, school_incidents = load_incident_tables()
+    county_assignment = update_county_assignment(mass_shootings, load_geojson(COUNTIES))
+
+    aggregates = None if rebuild else load_aggregates(path)
+    updated = update_aggregates(aggregates, mass_shootings, school_incidents, county_assignment)
+    if updated is not aggregates:
+        replace_file(path, lambda temporary: pd.to_pickle(updated, temporary))
+
+    mismatches = verify_aggregates(updated, mass_shootings, school_incidents, county_assignment) if verify else []
+    return updated, mismatches
+
+
+
+############# SNAPSHOTS #############
+# every chart pre-rendered for the current dataset version; the app serves the Vega-Lite specs, and the SVG/PNG
+# renders (which need the vl-convert-python package) have the map topology inlined so they stand on their own
+
+SNAPSHOT_WIDTH = 800
+
+def inline_topology(spec, topology):
+    """Copy of a Vega-Lite spec with the bundled topology URL replaced by its contents."""
+    if isinstance(spec, dict):
+        if spec.get('url', '').endswith('us_topology.json'):
+            spec = {key: value for key, value in spec.items() if key != 'url'}
+            spec['values'] = topology
+        return {key: inline_topology(value, topology) for key, value in spec.items()}
+    if isinstance(spec, list):
+        return [inline_topology(value, topology) for value in spec]
+    return spec
+
+
+def export_snapshots(output_dir=None, formats=('json',)):
+    """Renders all dashboard charts into <output_dir>/<dataset version>/ and returns that directory."""
+    from Jolis_Massana_FinalVisualitzation import CHART_NAMES, SNAPSHOT_DIR, compute_charts, dataset_version
+
+    version = dataset_version()
+    version_dir = os.path.join(output_dir or SNAPSHOT_DIR, version)
+    os.makedirs(version_dir, exist_ok=True)
+
+    charts = compute_charts()
+    specs = {name: charts[name].to_dict() for name in CHART_NAMES}
+    for name, spec in specs.items():
+        with open(os.path.join(version_dir, f'{name}.vl.json'), 'w') as output:
+            json.dump(spec, output, separators=(',', ':'))
+
+    formats = set(formats) | {'json'} # the app serves the Vega-Lite specs
+    if 'svg' in formats or 'png' in formats:
+        try:
+            import vl_convert # only needed for the image snapshots
+        except ImportError:
+            images = sorted(formats & {'svg', 'png'})
+            print(f"skipping the {' and '.join(images)} snapshots, they need the vl-convert-python package")
+            formats -= set(images)
+
+    if 'svg' in formats or 'png' in formats:
+        with open(os.path.join(STATIC_DIR, 'us_topology.json')) as f:
+            topology = json.load(f)
+        for name, spec in specs.items():
+            spec = inline_topology(spec, topology)
+            # 'container' widths have no container to fit outside the page
+            spec['width'] = SNAPSHOT_WIDTH
+            if 'svg' in formats:
+                with open(os.path.join(version_dir, f'{name}.svg'), 'w') as output:
+                    output.write(vl_convert.vegalite_to_svg(spec))
+            if 'png' in formats:
+                with open(os.path.join(version_dir, f'{name}.png'), 'wb') as output:
+                    output.write(vl_convert.vegalite_to_png(spec))
+
+    with open(os.path.join(version_dir, 'manifest.json'), 'w') as output:
+        json.dump({'version': version, 'charts': CHART_NAMES, 'formats': sorted(formats)}, output, indent=1)
+    return version_dir
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Data preparation steps for the dashboard.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    raw = commands.add_parser('raw', help='clean a raw incident export')
+    raw.add_argument('raw_path')
+    raw.add_argument('output_path')
+    raw.add_argument('--county-population', default='CountyPopulation.csv')
+    raw.add_argument('--chunksize', type=int, default=100_000)
+    raw.add_argument('--geocode-cache', default=GEOCODE_CACHE)
+    raw.add_argument('--geocoder', help="'module:function' called for addresses missing from the cache")
+    raw.add_argument('--seed', help='cleaned incidents file whose coordinates are added to the cache first')
+    raw.add_argument('--assign-counties', metavar='ASSIGNMENT_PATH', nargs='?', const='MassShootings_Counties.csv',
+                     help='also append the county of every new incident to the stored county assignment')
+
+    binary = commands.add_parser('binary', help='write typed Feather copies of the datasets')
+    binary.add_argument('--directory', default='.')
+
+    topology = commands.add_parser('topology', help='rebuild the bundled map topology (needs the topojson package)')
+    topology.add_argument('--output-dir', default=STATIC_DIR)
+    topology.add_argument('--simplify', type=float, default=TOPOLOGY_SIMPLIFY,
+                          help='simplification tolerance of the arcs, in degrees (0 keeps the full detail)')
+
+    aggregates = commands.add_parser('aggregates', help='apply the newly appended incidents to the stored tallies')
+    aggregates.add_argument('--path', help='defaults to aggregates.pkl')
+    aggregates.add_argument('--rebuild', action='store_true', help='recompute the tallies from scratch')
+    aggregates.add_argument('--verify', action='store_true', help='check the result against a full recompute')
+
+    snapshot = commands.add_parser('snapshot', help='pre-render every chart for the current datasets')
+    snapshot.add_argument('--output-dir', help='defaults to static/snapshots')
+    snapshot.add_argument('--formats', nargs='+', choices=['json', 'svg', 'png'], default=['json'],
+                          help='svg and png need the vl-convert-python package and are skipped without it')
+
+    args = parser.parse_args()
+    if args.command == 'raw':
+        geocoder = import_geocoder(args.geocoder) if args.geocoder else None
+        county_locator = None
+        if args.assign_counties:
+            from Jolis_Massana_FinalVisualitzation import CountyLocator
+            county_locator = CountyLocator(gpd.read_file(COUNTIES))
+        with GeocodeCache(args.geocode_cache, geocoder) as cache:
+            if args.seed:
+                print(f'{cache.seed(args.seed)} addresses cached from {args.seed}')
+            rows = ingest_raw(args.raw_path, args.output_path, args.county_population, args.chunksize, cache,
+                              county_locator, args.assign_counties)
+            stats = cache.stats()
+        print(f'{args.raw_path} -> {args.output_path} ({rows} rows)')
+        print(f"geocode cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate)")
+    elif args.command == 'binary':
+        convert_all(args.directory)
+    elif args.command == 'topology':
+        n_counties, n_states = build_topology(output_dir=args.output_dir, simplify=args.simplify)
+        print(f'{COUNTIES} -> {args.output_dir}/us_topology.json ({n_counties} counties, {n_states} states)')
+    elif args.command == 'aggregates':
+        start = time.perf_counter()
+        aggregates, mismatches = refresh_stored_aggregates(args.path, args.rebuild, args.verify)
+        print(f"tallies up to incident {aggregates['last_incident_id']} and school incident "
+              f"{aggregates['last_school_incident_id']} ({time.perf_counter() - start:.2f} s)")
+        if args.verify:
+            if mismatches:
+                raise SystemExit(f"incremental tallies differ from a full recompute: {', '.join(mismatches)}")
+            print('verified against a full recompute')
+    elif args.command == 'snapshot':
+        print(f'charts -> {export_snapshots(args.output_dir, args.formats)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+import os
+import sys
+import warnings
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# the dashboard module is imported outside `streamlit run`, its cached loaders warn about the missing runtime
+warnings.filterwarnings('ignore', message='.*No runtime found.*')
+
+
+@pytest.fixture(scope='session')
+def datasets():
+    """MassShootings.csv, SchoolIncidents.csv and the stored county assignment, as the dashboard loads them."""
+    from Jolis_Massana_FinalVisualitzation import load_incident_tables
+
+    cwd = os.getcwd()
+    os.chdir(ROOT) # the dashboard reads its datasets from the working directory
+    try:
+        mass_shootings, school_incidents = load_incident_tables()
+    finally:
+        os.chdir(cwd)
+    county_assignment = pd.read_csv(os.path.join(ROOT, 'MassShootings_Counties.csv'), dtype={'GEOID': 'Int32'})
+    return mass_shootings, school_incidents, county_assignment
@@ -0,0 +1,74 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+import Jolis_Massana_FinalVisualitzation as dashboard
+from conftest import ROOT
+from Jolis_Massana_FinalVisualitzation import (compute_aggregates, load_aggregates, prepare_data, refresh_aggregates,
+                                               replace_file, verify_aggregates)
+
+
+def test_refresh_matches_full_recompute(datasets, tmp_path):
+    mass_shootings, school_incidents, county_assignment = datasets
+    # tallies stored before the newest fifth of each feed was appended
+    stored = compute_aggregates(
+        mass_shootings[mass_shootings['Incident ID'] <= mass_shootings['Incident ID'].quantile(0.8)],
+        school_incidents[school_incidents['Incident ID'] <= school_incidents['Incident ID'].quantile(0.8)],
+        county_assignment,
+    )
+    path = tmp_path / 'aggregates.pkl'
+    pd.to_pickle(stored, path)
+
+    refreshed = refresh_aggregates(mass_shootings, school_incidents, county_assignment, path)
+    assert refreshed['last_incident_id'] > stored['last_incident_id']
+    assert verify_aggregates(refreshed, mass_shootings, school_incidents, county_assignment) == []
+    assert verify_aggregates(load_aggregates(path), mass_shootings, school_incidents, county_assignment) == []
+    assert os.listdir(tmp_path) == ['aggregates.pkl']
+
+
+def test_refresh_without_new_incidents_keeps_the_file(datasets, tmp_path):
+    mass_shootings, school_incidents, county_assignment = datasets
+    path = tmp_path / 'aggregates.pkl'
+    pd.to_pickle(compute_aggregates(mass_shootings, school_incidents, county_assignment), path)
+    modified = os.stat(path).st_mtime_ns
+
+    refresh_aggregates(mass_shootings, school_incidents, county_assignment, path)
+    assert os.stat(path).st_mtime_ns == modified
+
+
+def test_replace_file_keeps_the_old_file_when_writing_fails(tmp_path):
+    path = tmp_path / 'tallies.csv'
+    path.write_text('old')
+
+    def write(temporary):
+        with open(temporary, 'w') as output:
+            output.write('half')
+        raise OSError('disk full')
+
+    with pytest.raises(OSError):
+        replace_file(path, write)
+    assert path.read_text() == 'old'
+    assert os.listdir(tmp_path) == ['tallies.csv']
+
+
+def test_sessions_share_one_preparation(tmp_path, monkeypatch):
+    for name in ['MassShootings.csv', 'SchoolIncidents.csv', 'CountyPopulation.csv', 'Counties.geojson', 'MassShootings_Counties.csv']:
+        shutil.copy(os.path.join(ROOT, name), tmp_path)
+    monkeypatch.chdir(tmp_path)
+    refreshes = []
+    def counted_refresh(*args):
+        refreshes.append(args)
+        return refresh_aggregates(*args)
+    monkeypatch.setattr(dashboard, 'refresh_aggregates', counted_refresh)
+
+    # sessions arriving together before the tallies are stored
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        prepared = list(pool.map(lambda session: prepare_data(), range(4)))
+    assert len(refreshes) == 1
+    assert all(data is prepared[0] for data in prepared)
+    # stored once, and known under the versions after that write
+    assert prepare_data() is prepared[0]
+    assert len(refreshes) == 1
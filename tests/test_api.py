@@ -0,0 +1,103 @@
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from api import AggregateStore, etag_matches, handle
+from conftest import ROOT
+from Jolis_Massana_FinalVisualitzation import compute_aggregates, county_dimension
+
+
+class FixedStore(AggregateStore):
+    """Store over tallies computed once, without reading or writing the stored files."""
+
+    def __init__(self, aggregates, counties):
+        super().__init__()
+        self.aggregates = aggregates
+        self.counties = counties
+        self.version = 'test'
+
+    def refresh(self):
+        pass
+
+
+@pytest.fixture(scope='module')
+def store(datasets):
+    counties = county_dimension(pd.read_csv(os.path.join(ROOT, 'CountyPopulation.csv')))
+    return FixedStore(compute_aggregates(*datasets), counties)
+
+
+def get(store, target, headers=()):
+    """(status, headers, body) of a GET request served by handle()."""
+    async def request():
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            server = await asyncio.start_server(lambda reader, writer: handle(reader, writer, store, executor), '127.0.0.1', 0)
+            async with server:
+                reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+                writer.write(''.join([f'GET {target} HTTP/1.1\r\n', *(f'{name}: {value}\r\n' for name, value in headers), '\r\n']).encode())
+                response = await reader.read()
+                writer.close()
+        return response
+
+    head, _, body = asyncio.run(request()).partition(b'\r\n\r\n')
+    status_line, *header_lines = head.decode().split('\r\n')
+    return int(status_line.split()[1]), dict(line.split(': ', 1) for line in header_lines), body
+
+
+def test_payload_keys(store):
+    states = json.loads(store.response('/states')[1])
+    assert {'State', 'FIPS', 'Total Shootings', 'Population', 'Shootings per 1M Habitants'} <= set(states[0])
+    counties = json.loads(store.response('/counties')[1])
+    assert set(counties[0]) == {'County FIPS', 'County', 'County Population', 'Total Shootings', 'Shootings per 100K habitants'}
+    months = json.loads(store.response('/months')[1])
+    assert set(months[0]) == {'State', 'Year_Month', 'Count'}
+    assert json.loads(store.response('/version')[1]) == {'version': 'test'}
+
+
+def test_filtered_payloads(store):
+    counties = json.loads(store.response('/counties', '2023-01', '2023-12', ('Texas',))[1])
+    assert counties and all(county['County FIPS'] // 1000 == 48 for county in counties)
+    months = json.loads(store.response('/months', '2023-01', '2023-12', ('Texas',))[1])
+    assert {month['State'] for month in months} == {'Texas'}
+    assert all('2023-01' <= month['Year_Month'] <= '2023-12' for month in months)
+
+
+def test_responses_are_memoized(store):
+    etag, body = store.response('/states', '2023-01', None, ('Ohio',))
+    assert store.response('/states', '2023-01', None, ('Ohio',)) == (etag, body)
+    assert store.response('/states', '2023-02', None, ('Ohio',))[0] != etag
+    assert store.response('/unknown') is None
+
+
+def test_etag_and_not_modified(store):
+    status, headers, body = get(store, '/states?states=Texas,Ohio')
+    assert status == 200 and [state['State'] for state in json.loads(body)] == ['Ohio', 'Texas']
+
+    status, not_modified_headers, body = get(store, '/states?states=Ohio,Texas', [('If-None-Match', headers['ETag'])])
+    assert status == 304 and body == b''
+    assert not_modified_headers['ETag'] == headers['ETag']
+
+    status, _, body = get(store, '/states?states=Texas', [('If-None-Match', headers['ETag'])])
+    assert status == 200 and body
+
+
+def test_etag_lists(store):
+    _, headers, _ = get(store, '/months')
+    etag = headers['ETag']
+    assert get(store, '/months', [('If-None-Match', f'"0123", {etag}')])[0] == 304
+    assert get(store, '/months', [('If-None-Match', f'W/{etag}')])[0] == 304
+    assert get(store, '/months', [('If-None-Match', '*')])[0] == 304
+    assert get(store, '/months', [('If-None-Match', '"0123", W/"4567"')])[0] == 200
+
+
+def test_etag_matches():
+    assert etag_matches('"a", "b"', '"b"') and etag_matches('W/"a"', '"a"') and etag_matches('*', '"a"')
+    assert not etag_matches(None, '"a"') and not etag_matches('"ab"', '"a"')
+
+
+def test_bad_requests(store):
+    assert get(store, '/states?first_month=2023-13')[0] == 400
+    assert get(store, '/unknown')[0] == 404
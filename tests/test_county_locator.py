@@ -0,0 +1,55 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import ROOT
+from Jolis_Massana_FinalVisualitzation import CountyLocator, prepare_counties
+
+
+@pytest.fixture(scope='module')
+def raw_counties():
+    return gpd.read_file(os.path.join(ROOT, 'Counties.geojson'))
+
+
+@pytest.fixture(scope='module')
+def locators(raw_counties):
+    gridded = CountyLocator(raw_counties)
+    gridded.build_grid()
+    return {'exact': CountyLocator(raw_counties, cell_size=None), 'grid': gridded}
+
+
+def sjoin_assign(points_x, points_y, counties_gdf):
+    points_gdf = gpd.GeoDataFrame(geometry=gpd.points_from_xy(points_x, points_y), crs=counties_gdf.crs)
+    geoids = points_gdf.sjoin(counties_gdf, how='left', predicate='within')['GEOID']
+    return pd.to_numeric(geoids).astype('Int32').array
+
+
+def test_random_points_agree_with_sjoin(raw_counties, locators):
+    rng = np.random.default_rng(0)
+    # the contiguous US, Alaska and Hawaii, in the incident data's coordinate order (latitude first)
+    x = np.concatenate([rng.uniform(24.5, 49.5, 20_000), rng.uniform(54, 71, 500), rng.uniform(18.9, 22.3, 500)])
+    y = np.concatenate([rng.uniform(-125.0, -66.9, 20_000), rng.uniform(-168, -141, 500), rng.uniform(-160.3, -154.8, 500)])
+    expected = sjoin_assign(x, y, prepare_counties(raw_counties))
+    assert expected.isna().any() and not expected.isna().all()
+    for name, locator in locators.items():
+        assert locator.locate(x, y).equals(expected), name
+
+
+def test_incidents_agree_with_sjoin(raw_counties, locators, datasets):
+    mass_shootings = datasets[0]
+    x = np.append(mass_shootings['Longitude'].to_numpy(dtype=float), np.nan)
+    y = np.append(mass_shootings['Latitude'].to_numpy(dtype=float), np.nan)
+    expected = sjoin_assign(x, y, prepare_counties(raw_counties))
+    for name, locator in locators.items():
+        located = locator.locate(x, y)
+        assert located.equals(expected), name
+        assert pd.isna(located[-1])
+
+
+def test_locate_point(locators):
+    x, y = np.array([37.6872]), np.array([-97.3301]) # Wichita
+    assert locators['exact'].locate_point(x[0], y[0]) == locators['grid'].locate(x, y)[0] == 20173
+    assert locators['exact'].locate_point(0.0, 0.0) is None
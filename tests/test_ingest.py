@@ -0,0 +1,101 @@
+import os
+
+import pandas as pd
+
+from conftest import ROOT
+from ingest import GeocodeCache, ingest_raw, normalize_address
+
+
+class StubGeocoder:
+    """Geocoder answering with lookup(address) and recording its calls."""
+
+    def __init__(self, lookup):
+        self.lookup = lookup
+        self.calls = []
+
+    def __call__(self, address):
+        self.calls.append(address)
+        return self.lookup(address)
+
+
+def test_normalize_address():
+    assert normalize_address('5000 Block of  Kensington Ave , Saint Louis,Missouri') == '5000 kensington ave,saint louis,missouri'
+
+
+def test_geocode_cache_hits_and_misses(tmp_path):
+    geocoder = StubGeocoder({'1 Main St,Akron,Ohio': (41.08, -81.51)}.get)
+    with GeocodeCache(tmp_path / 'cache.sqlite', geocoder) as cache:
+        assert tuple(cache('1 Main St,Akron,Ohio')) == (41.08, -81.51)
+        # same address up to case and spacing
+        assert tuple(cache('1 main st , Akron,Ohio')) == (41.08, -81.51)
+        assert cache.stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+    assert geocoder.calls == ['1 Main St,Akron,Ohio']
+
+
+def test_geocode_cache_keeps_failures(tmp_path):
+    geocoder = StubGeocoder(lambda address: None)
+    with GeocodeCache(tmp_path / 'cache.sqlite', geocoder) as cache:
+        assert cache('Nowhere,Akron,Ohio') is None
+    # a new cache on the same file answers the failed lookup without calling the geocoder again
+    with GeocodeCache(tmp_path / 'cache.sqlite', geocoder) as cache:
+        assert cache('Nowhere,Akron,Ohio') is None
+        assert cache.stats()['hits'] == 1
+    assert geocoder.calls == ['Nowhere,Akron,Ohio']
+
+
+def test_geocode_cache_without_geocoder(tmp_path):
+    with GeocodeCache(tmp_path / 'cache.sqlite') as cache:
+        assert cache('1 Main St,Akron,Ohio') is None
+        assert cache.stats()['misses'] == 1
+
+
+def test_ingest_raw_geocodes_each_address_once(tmp_path):
+    raw = pd.read_csv(os.path.join(ROOT, 'MassShootings_RAW.csv'), nrows=50)
+    raw_path = tmp_path / 'raw.csv'
+    raw.to_csv(raw_path, index=False)
+
+    # every address is placed at the same point, except those in Missouri which the geocoder cannot place
+    geocoder = StubGeocoder(lambda address: None if address.endswith('Missouri') else (38.6, -90.2))
+
+    county_population = os.path.join(ROOT, 'CountyPopulation.csv')
+    with GeocodeCache(tmp_path / 'cache.sqlite', geocoder) as cache:
+        rows = ingest_raw(raw_path, tmp_path / 'first.csv', county_population, chunksize=20, geocoder=cache)
+        first_calls = len(geocoder.calls)
+        assert ingest_raw(raw_path, tmp_path / 'second.csv', county_population, chunksize=20, geocoder=cache) == rows
+        assert len(geocoder.calls) == first_calls
+        assert cache.stats()['hits'] == first_calls
+
+    cleaned = pd.read_csv(tmp_path / 'second.csv')
+    assert rows == len(cleaned) == (raw['Address'].notna() & (raw['State'] != 'Missouri')).sum()
+    assert (cleaned['Longitude'] == 38.6).all() and (cleaned['Latitude'] == -90.2).all()
+
+
+class StubLocator:
+    """County locator placing every point in the same county."""
+
+    def locate(self, longitudes, latitudes):
+        return pd.array([29510] * len(longitudes), dtype='Int32')
+
+
+def test_ingest_raw_adds_the_new_county_assignments(tmp_path):
+    raw = pd.read_csv(os.path.join(ROOT, 'MassShootings_RAW.csv'), nrows=50)
+    raw_path = tmp_path / 'raw.csv'
+    raw.to_csv(raw_path, index=False)
+    assignment_path = tmp_path / 'counties.csv'
+    stored = pd.DataFrame({'Incident ID': raw['Incident ID'][:5], 'GEOID': pd.array([1001] * 5, dtype='Int32')})
+    stored.to_csv(assignment_path, index=False)
+
+    county_population = os.path.join(ROOT, 'CountyPopulation.csv')
+    geocoder = StubGeocoder(lambda address: (38.6, -90.2))
+    for output in ('first.csv', 'second.csv'):
+        rows = ingest_raw(raw_path, tmp_path / output, county_population, chunksize=20, geocoder=geocoder,
+                          county_locator=StubLocator(), assignment_path=assignment_path)
+
+    assignment = pd.read_csv(assignment_path, dtype={'GEOID': 'Int32'})
+    assert assignment['Incident ID'].is_unique
+    assert len(assignment) == len(set(stored['Incident ID']) | set(pd.read_csv(tmp_path / 'first.csv')['Incident ID']))
+    # the stored assignments are kept, the new ones added
+    assert (assignment.set_index('Incident ID').loc[stored['Incident ID'], 'GEOID'] == 1001).all()
+    assert (assignment['GEOID'] == 29510).sum() == len(assignment) - 5
+    assert sorted(os.listdir(tmp_path)) == ['counties.csv', 'first.csv', 'raw.csv', 'second.csv']
+    assert rows > 5
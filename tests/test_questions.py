@@ -0,0 +1,18 @@
+from Jolis_Massana_FinalVisualitzation import fourth_question, monthly_counts
+
+
+def test_fourth_question_within_the_complete_months(datasets):
+    mass_shootings = datasets[0]
+    months = [str(month) for month in monthly_counts(mass_shootings).columns]
+    spec = fourth_question(mass_shootings, months=(months[1], months[3])).to_dict()
+    line = spec['datasets'][spec['layer'][0]['data']['name']]
+    assert len(line) == 3
+
+
+def test_fourth_question_without_a_complete_month(datasets):
+    mass_shootings = datasets[0]
+    months = [str(month) for month in monthly_counts(mass_shootings).columns]
+    # the first and last months are incomplete and left out of the line chart
+    for month in (months[0], months[-1]):
+        spec = fourth_question(mass_shootings, months=(month, month)).to_dict()
+        assert spec['title']['subtitle'] == 'No complete month in the selected range'